@@ -2,95 +2,145 @@
 Analytics API for organization metrics and insights
 """
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import func, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, text, case, and_, null
 from typing import Dict, Any, List
 from datetime import datetime, timedelta
+from types import SimpleNamespace
 import logging
 
-from database.database import get_db
-from database.models import Document, User
+from database.database import get_async_db, uses_org_stats_view
+from database.models import Document, DocumentDailyStats, User
 from auth.clerk_auth import get_current_user_compatible
+from services.analytics_cache import analytics_cache, ADMIN_CACHE_TTL, USER_CACHE_TTL
 
 router = APIRouter(prefix="/analytics", tags=["Analytics"])
 logger = logging.getLogger(__name__)
 
+# Returned when an organization has no row in the stats view yet
+_EMPTY_DOCUMENT_STATS = SimpleNamespace(
+    total=0, processed=0, processing=0, failed=0,
+    total_size=0, total_chunks=0, last_refreshed=None
+)
+
 def get_current_user(
     user_info: Dict[str, Any] = Depends(get_current_user_compatible)
 ) -> Dict[str, Any]:
     """Get current authenticated user"""
     return user_info
 
+async def _status_counts(db: AsyncSession, org_id) -> Dict[str, int]:
+    """Get document counts per processing status with a single GROUP BY"""
+    result = await db.execute(
+        select(
+            Document.processing_status,
+            func.count(Document.document_id).label('count')
+        ).where(
+            Document.org_id == org_id
+        ).group_by(
+            Document.processing_status
+        )
+    )
+    rows = result.all()
+    
+    return {row.processing_status: row.count for row in rows}
+
+async def _document_stats(db: AsyncSession, org_id, since: datetime):
+    """
+    Get document count/storage aggregates for an organization
+    Served from the mv_org_document_stats materialized view when it exists,
+    computed with a single conditional aggregate otherwise
+    """
+    if await uses_org_stats_view(db):
+        result = await db.execute(
+            text(
+                "SELECT total, processed, processing, failed, total_size, "
+                "total_chunks, last_refreshed "
+                "FROM mv_org_document_stats WHERE org_id = :org_id"
+            ),
+            {"org_id": org_id}
+        )
+        row = result.first()
+        # The view only refreshes after writes, so the rolling window is counted live (idx_docs_org_upload)
+        recent_result = await db.execute(
+            select(func.count(Document.document_id)).where(
+                Document.org_id == org_id,
+                Document.upload_date >= since
+            )
+        )
+        stats = row._asdict() if row else vars(_EMPTY_DOCUMENT_STATS)
+        return SimpleNamespace(**stats, recent_30d=recent_result.scalar() or 0)
+    
+    result = await db.execute(
+        select(
+            func.count(Document.document_id).label('total'),
+            func.sum(case((Document.processing_status == "completed", 1), else_=0)).label('processed'),
+            func.sum(case((Document.processing_status == "processing", 1), else_=0)).label('processing'),
+            func.sum(case((Document.processing_status == "failed", 1), else_=0)).label('failed'),
+            func.sum(Document.file_size).label('total_size'),
+            func.sum(case(
+                (Document.processing_status == "completed", Document.chunks_created), else_=0
+            )).label('total_chunks'),
+            func.sum(case((Document.upload_date >= since, 1), else_=0)).label('recent_30d'),
+            null().label('last_refreshed')
+        ).where(
+            Document.org_id == org_id
+        )
+    )
+    return result.one()
+
 @router.get("/overview")
 async def get_analytics_overview(
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get comprehensive analytics overview for organization"""
     try:
         org_id = current_user["org_id"]
         
-        # Document Statistics
-        total_documents = db.query(Document).filter(
-            Document.org_id == org_id
-        ).count()
-        
-        processed_documents = db.query(Document).filter(
-            Document.org_id == org_id,
-            Document.processing_status == "completed"
-        ).count()
-        
-        processing_documents = db.query(Document).filter(
-            Document.org_id == org_id,
-            Document.processing_status == "processing"
-        ).count()
-        
-        failed_documents = db.query(Document).filter(
-            Document.org_id == org_id,
-            Document.processing_status == "failed"
-        ).count()
-        
-        # Storage Statistics
-        total_storage = db.query(func.sum(Document.file_size)).filter(
-            Document.org_id == org_id
-        ).scalar() or 0
-        
-        total_chunks = db.query(func.sum(Document.chunks_created)).filter(
-            Document.org_id == org_id,
-            Document.processing_status == "completed"
-        ).scalar() or 0
-        
-        # User Statistics
-        total_users = db.query(User).filter(
-            User.org_id == org_id,
-            User.is_active == True
-        ).count()
-        
-        admin_users = db.query(User).filter(
-            User.org_id == org_id,
-            User.role == "admin",
-            User.is_active == True
-        ).count()
+        cache_key = analytics_cache.key("overview", org_id)
+        cached = await analytics_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
         # Recent Activity (last 30 days)
         thirty_days_ago = datetime.utcnow() - timedelta(days=30)
         
-        recent_documents = db.query(Document).filter(
-            Document.org_id == org_id,
-            Document.upload_date >= thirty_days_ago
-        ).count()
+        # Document and storage statistics
+        doc_stats = await _document_stats(db, org_id, thirty_days_ago)
+        
+        total_documents = doc_stats.total or 0
+        processed_documents = doc_stats.processed or 0
+        processing_documents = doc_stats.processing or 0
+        failed_documents = doc_stats.failed or 0
+        total_storage = doc_stats.total_size or 0
+        total_chunks = doc_stats.total_chunks or 0
+        recent_documents = doc_stats.recent_30d or 0
+        
+        # User statistics in a single aggregate query
+        user_result = await db.execute(
+            select(
+                func.sum(case((User.is_active == True, 1), else_=0)).label('total'),
+                func.sum(case(
+                    (and_(User.role == "admin", User.is_active == True), 1), else_=0
+                )).label('admins'),
+                func.sum(case((User.created_at >= thirty_days_ago, 1), else_=0)).label('recent')
+            ).where(
+                User.org_id == org_id
+            )
+        )
+        user_stats = user_result.one()
         
-        recent_users = db.query(User).filter(
-            User.org_id == org_id,
-            User.created_at >= thirty_days_ago
-        ).count()
+        total_users = user_stats.total or 0
+        admin_users = user_stats.admins or 0
+        recent_users = user_stats.recent or 0
         
         # Document Processing Health
         success_rate = 0
         if total_documents > 0:
             success_rate = round((processed_documents / total_documents) * 100, 1)
         
-        return {
+        result = {
             "organization": {
                 "org_id": org_id,
                 "total_users": total_users,
@@ -113,10 +163,14 @@ async def get_analytics_overview(
             "activity": {
                 "documents_uploaded_30d": recent_documents,
                 "users_added_30d": recent_users,
-                "last_updated": datetime.utcnow().isoformat()
+                "last_updated": datetime.utcnow(),
+                "stats_refreshed_at": doc_stats.last_refreshed
             }
         }
         
+        await analytics_cache.set(cache_key, result, ttl=USER_CACHE_TTL)
+        return result
+        
     except Exception as e:
         logger.error(f"Error fetching analytics overview: {e}")
         raise HTTPException(
@@ -127,47 +181,57 @@ async def get_analytics_overview(
 @router.get("/documents/timeline")
 async def get_documents_timeline(
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     days: int = 30
 ):
     """Get document upload timeline for the last N days"""
     try:
         org_id = current_user["org_id"]
         
+        cache_key = analytics_cache.key(f"timeline:{days}", org_id)
+        cached = await analytics_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         # Calculate date range
         end_date = datetime.utcnow()
         start_date = end_date - timedelta(days=days)
         
-        # Query documents grouped by date
-        timeline_query = db.query(
-            func.date(Document.upload_date).label('date'),
-            func.count(Document.document_id).label('count'),
-            func.sum(Document.file_size).label('total_size')
-        ).filter(
-            Document.org_id == org_id,
-            Document.upload_date >= start_date
-        ).group_by(
-            func.date(Document.upload_date)
-        ).order_by(
-            func.date(Document.upload_date)
-        ).all()
+        # Read the pre-aggregated daily rollup, one row per day
+        timeline_result = await db.execute(
+            select(
+                DocumentDailyStats.day,
+                DocumentDailyStats.document_count,
+                DocumentDailyStats.total_size
+            ).where(
+                DocumentDailyStats.org_id == org_id,
+                DocumentDailyStats.day >= start_date.date(),
+                DocumentDailyStats.document_count > 0
+            ).order_by(
+                DocumentDailyStats.day
+            )
+        )
+        timeline_query = timeline_result.all()
         
         # Format timeline data
         timeline_data = []
         for row in timeline_query:
             timeline_data.append({
-                "date": row.date.isoformat(),
-                "documents_uploaded": row.count,
+                "date": row.day,
+                "documents_uploaded": row.document_count,
                 "total_size_mb": round((row.total_size or 0) / (1024 * 1024), 2)
             })
         
-        return {
+        result = {
             "timeline": timeline_data,
             "period_days": days,
-            "start_date": start_date.isoformat(),
-            "end_date": end_date.isoformat()
+            "start_date": start_date,
+            "end_date": end_date
         }
         
+        await analytics_cache.set(cache_key, result, ttl=USER_CACHE_TTL)
+        return result
+        
     except Exception as e:
         logger.error(f"Error fetching documents timeline: {e}")
         raise HTTPException(
@@ -178,49 +242,53 @@ async def get_documents_timeline(
 @router.get("/documents/types")
 async def get_document_types_breakdown(
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get breakdown of document types in organization"""
     try:
         org_id = current_user["org_id"]
         
-        # Query document types
-        types_query = db.query(
-            Document.file_type,
-            func.count(Document.document_id).label('count'),
-            func.sum(Document.file_size).label('total_size'),
-            func.avg(Document.file_size).label('avg_size')
-        ).filter(
-            Document.org_id == org_id
-        ).group_by(
-            Document.file_type
-        ).order_by(
-            func.count(Document.document_id).desc()
-        ).all()
+        cache_key = analytics_cache.key("types", org_id)
+        cached = await analytics_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        # Query document types, with grand totals as window aggregates over the groups
+        types_result = await db.execute(
+            select(
+                Document.file_type,
+                func.count(Document.document_id).label('count'),
+                func.sum(Document.file_size).label('total_size'),
+                func.avg(Document.file_size).label('avg_size'),
+                func.sum(func.count(Document.document_id)).over().label('grand_count'),
+                func.sum(func.sum(Document.file_size)).over().label('grand_size')
+            ).where(
+                Document.org_id == org_id
+            ).group_by(
+                Document.file_type
+            ).order_by(
+                func.count(Document.document_id).desc()
+            )
+        )
+        types_query = types_result.all()
         
-        # Format breakdown data
-        breakdown_data = []
-        total_docs = 0
-        total_size = 0
+        # Format breakdown data in a single pass
+        total_docs = int(types_query[0].grand_count) if types_query else 0
+        # PostgreSQL returns numeric sum/avg as Decimal; cast so responses stay JSON-serializable
+        total_size = float(types_query[0].grand_size or 0) if types_query else 0
         
+        breakdown_data = []
         for row in types_query:
-            count = row.count
-            size = row.total_size or 0
-            total_docs += count
-            total_size += size
-            
+            size = float(row.total_size or 0)
             breakdown_data.append({
                 "file_type": row.file_type,
-                "document_count": count,
+                "document_count": row.count,
                 "total_size_mb": round(size / (1024 * 1024), 2),
-                "average_size_mb": round((row.avg_size or 0) / (1024 * 1024), 2)
+                "average_size_mb": round(float(row.avg_size or 0) / (1024 * 1024), 2),
+                "percentage": round((row.count / max(total_docs, 1)) * 100, 1)
             })
         
-        # Calculate percentages
-        for item in breakdown_data:
-            item["percentage"] = round((item["document_count"] / max(total_docs, 1)) * 100, 1)
-        
-        return {
+        result = {
             "breakdown": breakdown_data,
             "summary": {
                 "total_documents": total_docs,
@@ -229,6 +297,9 @@ async def get_document_types_breakdown(
             }
         }
         
+        await analytics_cache.set(cache_key, result, ttl=USER_CACHE_TTL)
+        return result
+        
     except Exception as e:
         logger.error(f"Error fetching document types: {e}")
         raise HTTPException(
@@ -239,28 +310,20 @@ async def get_document_types_breakdown(
 @router.get("/processing/health")
 async def get_processing_health(
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get document processing health metrics"""
     try:
         org_id = current_user["org_id"]
         
-        # Processing status breakdown
-        status_query = db.query(
-            Document.processing_status,
-            func.count(Document.document_id).label('count')
-        ).filter(
-            Document.org_id == org_id
-        ).group_by(
-            Document.processing_status
-        ).all()
-        
-        status_breakdown = {}
-        total_documents = 0
+        cache_key = analytics_cache.key("processing_health", org_id)
+        cached = await analytics_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
-        for row in status_query:
-            status_breakdown[row.processing_status] = row.count
-            total_documents += row.count
+        # Processing status breakdown
+        status_breakdown = await _status_counts(db, org_id)
+        total_documents = sum(status_breakdown.values())
         
         # Calculate processing metrics
         completed = status_breakdown.get("completed", 0)
@@ -274,21 +337,29 @@ async def get_processing_health(
         avg_processing_time = "45 seconds"  # This would be calculated from actual data
         
         # Recent failures for debugging
-        recent_failures = db.query(Document).filter(
-            Document.org_id == org_id,
-            Document.processing_status == "failed"
-        ).order_by(Document.upload_date.desc()).limit(5).all()
+        failures_result = await db.execute(
+            select(
+                Document.original_filename,
+                Document.upload_date,
+                Document.file_type,
+                Document.file_size
+            ).where(
+                Document.org_id == org_id,
+                Document.processing_status == "failed"
+            ).order_by(Document.upload_date.desc()).limit(5)
+        )
+        recent_failures = failures_result.all()
         
         failure_details = []
         for doc in recent_failures:
             failure_details.append({
                 "filename": doc.original_filename,
-                "upload_date": doc.upload_date.isoformat(),
+                "upload_date": doc.upload_date,
                 "file_type": doc.file_type,
                 "file_size_mb": round(doc.file_size / (1024 * 1024), 2)
             })
         
-        return {
+        result = {
             "health_metrics": {
                 "total_documents": total_documents,
                 "success_rate": success_rate,
@@ -301,6 +372,9 @@ async def get_processing_health(
             "recommendations": get_processing_recommendations(success_rate, failure_rate, processing)
         }
         
+        await analytics_cache.set(cache_key, result, ttl=ADMIN_CACHE_TTL)
+        return result
+        
     except Exception as e:
         logger.error(f"Error fetching processing health: {e}")
         raise HTTPException(
@@ -308,23 +382,35 @@ async def get_processing_health(
             detail=f"Error fetching processing health: {str(e)}"
         )
 
+@router.get("/cache/stats")
+async def get_analytics_cache_stats(
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """Get analytics cache hit/miss metrics"""
+    if current_user["role"] != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only admin users can view cache statistics"
+        )
+    return analytics_cache.stats()
+
+# (condition on success_rate, failure_rate, processing_count) -> recommendation, checked in order
+PROCESSING_RULES = (
+    (lambda success, failure, processing: success < 80,
+     "Document processing success rate is below 80%. Consider checking file formats and sizes."),
+    (lambda success, failure, processing: failure > 20,
+     "High failure rate detected. Review failed documents and ensure supported file formats."),
+    (lambda success, failure, processing: processing > 10,
+     "Many documents are currently processing. Consider uploading smaller batches."),
+    (lambda success, failure, processing: success > 95,
+     "Excellent processing health! Your document pipeline is performing optimally."),
+)
+DEFAULT_RECOMMENDATION = "Processing health looks good. Continue monitoring for optimal performance."
+
 def get_processing_recommendations(success_rate: float, failure_rate: float, processing_count: int) -> List[str]:
     """Generate recommendations based on processing metrics"""
-    recommendations = []
-    
-    if success_rate < 80:
-        recommendations.append("Document processing success rate is below 80%. Consider checking file formats and sizes.")
-    
-    if failure_rate > 20:
-        recommendations.append("High failure rate detected. Review failed documents and ensure supported file formats.")
-    
-    if processing_count > 10:
-        recommendations.append("Many documents are currently processing. Consider uploading smaller batches.")
-    
-    if success_rate > 95:
-        recommendations.append("Excellent processing health! Your document pipeline is performing optimally.")
-    
-    if not recommendations:
-        recommendations.append("Processing health looks good. Continue monitoring for optimal performance.")
-    
-    return recommendations
\ No newline at end of file
+    recommendations = [
+        message for condition, message in PROCESSING_RULES
+        if condition(success_rate, failure_rate, processing_count)
+    ]
+    return recommendations or [DEFAULT_RECOMMENDATION]
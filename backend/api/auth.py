@@ -3,11 +3,11 @@ Authentication API routes
 """
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Dict, Any
 import uuid
 
-from database.database import get_db
+from database.database import get_async_db
 from schemas.auth import (
     UserLogin, 
     UserRegister, 
@@ -20,7 +20,7 @@ from services.auth_service import AuthService
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 security = HTTPBearer()
 
-def get_auth_service(db: Session = Depends(get_db)) -> AuthService:
+def get_auth_service(db: AsyncSession = Depends(get_async_db)) -> AuthService:
     """Dependency to get auth service"""
     return AuthService(db)
 
@@ -48,7 +48,7 @@ async def register_user(
             detail="Invalid organization ID format"
         )
     
-    result = auth_service.register_user(org_uuid, user_data)
+    result = await auth_service.register_user(org_uuid, user_data)
     
     if not result["success"]:
         raise HTTPException(
@@ -71,7 +71,7 @@ async def login(
     User login with email and password
     Returns JWT token with org context
     """
-    result = auth_service.authenticate_user(login_data)
+    result = await auth_service.authenticate_user(login_data)
     
     if not result["success"]:
         raise HTTPException(
@@ -93,7 +93,7 @@ async def get_profile(
     """
     Get current user profile from token
     """
-    profile = auth_service.get_user_profile(token)
+    profile = await auth_service.get_user_profile(token)
     
     if "error" in profile:
         raise HTTPException(
@@ -112,7 +112,7 @@ async def change_password(
     """
     Change user password
     """
-    result = auth_service.change_password(
+    result = await auth_service.change_password(
         token,
         password_data.current_password,
         password_data.new_password
@@ -134,7 +134,7 @@ async def verify_token(
     """
     Verify if token is valid and get user info
     """
-    user = auth_service.get_user_by_token(token)
+    user = await auth_service.get_user_by_token(token)
     
     if not user:
         raise HTTPException(
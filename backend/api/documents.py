@@ -1,18 +1,25 @@
 """
 Multi-tenant document management API
 """
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, BackgroundTasks, Response, Header
+from fastapi.responses import ORJSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from typing import List, Dict, Any
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, case
+from typing import List, Dict, Any, Optional, BinaryIO, Iterable, Iterator
 import uuid
-import hashlib
 import os
+import asyncio
+import codecs
+import logging
+import tempfile
 from datetime import datetime
+from blake3 import blake3
 
-from database.database import get_db
+from database.database import get_async_db, AsyncSessionLocal, schedule_org_stats_refresh, update_daily_stats
 from database.models import Document, User
 from services.auth_service import AuthService
+from services.analytics_cache import analytics_cache
 from schemas.auth import UserProfile
 from auth.clerk_auth import get_current_user_compatible
 from retriever.multi_tenant_vector_store import MultiTenantVectorStore, get_vector_store
@@ -20,6 +27,20 @@ from langchain.schema import Document as LangchainDocument
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 router = APIRouter(prefix="/documents", tags=["Document Management"])
+logger = logging.getLogger(__name__)
+
+# Upload streaming settings
+UPLOAD_READ_SIZE = 1024 * 1024  # 1MB reads
+UPLOAD_SPOOL_MAX_SIZE = 8 * 1024 * 1024  # spill uploads larger than this to disk
+SPLIT_WINDOW_SIZE = 16000  # characters buffered before running the splitter
+VECTOR_BATCH_SIZE = 64  # chunks per vector store insert
+
+# Splitter config is fixed, so build it (and its separator regexes) once
+_TEXT_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=1000,
+    chunk_overlap=200,
+    length_function=len
+)
 
 # Use Clerk authentication or fallback to custom auth
 def get_current_user(
@@ -29,24 +50,212 @@ def get_current_user(
     """Get current authenticated user (Clerk or custom auth)"""
     return user_info
 
-@router.post("/upload")
+def _iter_text(fileobj: BinaryIO, file_extension: str) -> Iterator[str]:
+    """Yield document text piece by piece (per page, paragraph or block)"""
+    if file_extension == 'txt' or file_extension == 'text':
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        while True:
+            block = fileobj.read(UPLOAD_READ_SIZE)
+            if not block:
+                break
+            yield decoder.decode(block)
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield tail
+    
+    elif file_extension == 'pdf':
+        # PyMuPDF's C extractor is an order of magnitude faster than pypdf per page, but it
+        # needs the whole file in memory; uploads large enough to spill to disk stay on pypdf,
+        # which seeks through the file object instead
+        start = fileobj.tell()
+        in_memory = fileobj.seek(0, os.SEEK_END) - start <= UPLOAD_SPOOL_MAX_SIZE
+        fileobj.seek(start)
+        
+        pymupdf = None
+        if in_memory:
+            try:
+                import pymupdf
+            except ImportError:
+                pass
+        
+        if pymupdf is not None:
+            with pymupdf.open(stream=fileobj.read(), filetype="pdf") as pdf:
+                for page in pdf:
+                    yield page.get_text() + "\n"
+        else:
+            from pypdf import PdfReader
+            for page in PdfReader(fileobj).pages:
+                yield (page.extract_text() or "") + "\n"
+    
+    elif file_extension == 'docx':
+        from docx import Document as DocxDocument
+        for paragraph in DocxDocument(fileobj).paragraphs:
+            yield paragraph.text + "\n"
+
+def _iter_chunks(pieces: Iterable[str]) -> Iterator[str]:
+    """Split a stream of text into chunks without materializing the whole document"""
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) >= SPLIT_WINDOW_SIZE:
+            chunks = _TEXT_SPLITTER.split_text(buffer)
+            # Carry the last chunk over so chunk boundaries don't follow page breaks
+            yield from chunks[:-1]
+            buffer = chunks[-1] if chunks else ""
+    
+    if buffer:
+        yield from _TEXT_SPLITTER.split_text(buffer)
+
+def _index_document(
+    fileobj: BinaryIO,
+    file_extension: str,
+    document_id: uuid.UUID,
+    org_id: uuid.UUID,
+    source: str,
+    vector_store: MultiTenantVectorStore
+) -> Dict[str, int]:
+    """
+    Stream text out of an upload, chunk it and push chunks to the vector store in batches
+    Runs in a worker thread; memory is bounded by the split window and batch size
+    """
+    text_length = 0
+    chunks_added = 0
+    batch: List[LangchainDocument] = []
+    
+    def counted(pieces: Iterator[str]) -> Iterator[str]:
+        nonlocal text_length
+        for piece in pieces:
+            text_length += len(piece)
+            yield piece
+    
+    def flush() -> int:
+        vector_result = vector_store.add_documents(
+            org_id=org_id,
+            documents=batch,
+            document_id=document_id,
+            start_index=chunks_added
+        )
+        if not vector_result["success"]:
+            raise RuntimeError(vector_result.get("error", "Vector store insert failed"))
+        return vector_result["chunks_added"]
+    
+    for chunk in _iter_chunks(counted(_iter_text(fileobj, file_extension))):
+        batch.append(LangchainDocument(
+            page_content=chunk,
+            metadata={
+                "source": source,
+                "document_id": str(document_id),
+                "chunk_index": chunks_added + len(batch),
+                "file_type": file_extension,
+                "org_id": str(org_id)
+            }
+        ))
+        if len(batch) >= VECTOR_BATCH_SIZE:
+            chunks_added += flush()
+            batch = []
+    
+    if batch:
+        chunks_added += flush()
+    
+    return {"text_length": text_length, "chunks_added": chunks_added}
+
+async def process_document_async(
+    document_id: uuid.UUID,
+    upload: BinaryIO,
+    file_extension: str,
+    org_id: uuid.UUID,
+    vector_store: MultiTenantVectorStore
+):
+    """
+    Extract, chunk and embed an uploaded document in the background
+    Marks the document completed or failed when done
+    """
+    try:
+        async with AsyncSessionLocal() as db:
+            document = await db.get(Document, document_id)
+            if not document:
+                logger.warning(f"Document {document_id} disappeared before processing")
+                return
+            
+            try:
+                # Extraction and embedding are CPU-bound, keep them off the event loop
+                index_result = await asyncio.to_thread(
+                    _index_document,
+                    upload,
+                    file_extension,
+                    document_id,
+                    org_id,
+                    document.filename,
+                    vector_store
+                )
+                
+                document.extracted_text_length = index_result["text_length"]
+                document.processing_status = "completed"
+                document.chunks_created = index_result["chunks_added"]
+                document.processed_date = datetime.utcnow()
+            
+            except Exception as e:
+                logger.error(f"Error processing document {document_id}: {e}")
+                # Drop any batches that made it into the vector store
+                try:
+                    await asyncio.to_thread(vector_store.delete_document, org_id, document_id)
+                except Exception as cleanup_error:
+                    logger.error(f"Error removing partial vectors for document {document_id}: {cleanup_error}")
+                document.processing_status = "failed"
+                document.doc_metadata = {**(document.doc_metadata or {}), "processing_error": str(e)}
+            
+            await db.commit()
+            schedule_org_stats_refresh(org_id)
+    finally:
+        upload.close()
+    
+    await analytics_cache.invalidate_org(org_id)
+
+async def _find_duplicate(db: AsyncSession, org_id: uuid.UUID, content_hash: str) -> Optional[Document]:
+    """Find an existing document in the organization with the same content hash"""
+    result = await db.execute(
+        select(Document).where(
+            Document.org_id == org_id,
+            Document.content_hash == content_hash
+        ).limit(1)
+    )
+    return result.scalars().first()
+
+def _duplicate_response(existing_doc: Document) -> Dict[str, Any]:
+    """Response body for an upload whose content already exists"""
+    return {
+        "status": "duplicate",
+        "message": f"Document with same content already exists: {existing_doc.filename}",
+        "existing_document_id": str(existing_doc.document_id)
+    }
+
+@router.post("/upload", status_code=status.HTTP_202_ACCEPTED)
 async def upload_document(
+    background_tasks: BackgroundTasks,
+    response: Response,
     file: UploadFile = File(...),
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db),
-    vector_store: MultiTenantVectorStore = Depends(get_vector_store)
+    db: AsyncSession = Depends(get_async_db),
+    vector_store: MultiTenantVectorStore = Depends(get_vector_store),
+    x_content_blake3: Optional[str] = Header(None)
 ):
     """
     Upload document to organization's knowledge base
     Requires authentication and admin role
+    
+    Returns 202 once the document is recorded; extraction and embedding run
+    in the background. Poll GET /documents/{document_id} for completion.
+    Clients may send an X-Content-BLAKE3 header with the file's hex digest
+    to skip processing entirely when the content is already stored.
     """
     # Check if user has admin permissions
-    if current_user.role != "admin":
+    if current_user["role"] != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Only admin users can upload documents"
         )
     
+    upload = None
     try:
         # Validate file type
         allowed_types = ['pdf', 'txt', 'docx', 'text']
@@ -58,136 +267,94 @@ async def upload_document(
                 detail=f"Unsupported file type. Allowed: {', '.join(allowed_types)}"
             )
         
-        # Read file content
-        content = await file.read()
-        file_size = len(content)
+        # Client-supplied hash lets re-uploads short-circuit before we copy or hash anything
+        if x_content_blake3:
+            existing_doc = await _find_duplicate(db, current_user["org_id"], x_content_blake3.lower())
+            if existing_doc:
+                response.status_code = status.HTTP_200_OK
+                return _duplicate_response(existing_doc)
+        
+        # Stream the upload into a spooled temp file, hashing as we go
+        upload = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_SIZE)
+        hasher = blake3()
+        file_size = 0
+        while True:
+            block = await file.read(UPLOAD_READ_SIZE)
+            if not block:
+                break
+            hasher.update(block)
+            upload.write(block)
+            file_size += len(block)
+        upload.seek(0)
         
         # Create content hash for deduplication
-        content_hash = hashlib.sha256(content).hexdigest()
+        content_hash = hasher.hexdigest()
         
-        # Check if document already exists
-        existing_doc = db.query(Document).filter(
-            Document.org_id == current_user.org_id,
-            Document.content_hash == content_hash
-        ).first()
+        # Check if document already exists, before any parsing work
+        existing_doc = await _find_duplicate(db, current_user["org_id"], content_hash)
         
         if existing_doc:
-            return {
-                "status": "duplicate",
-                "message": f"Document with same content already exists: {existing_doc.filename}",
-                "existing_document_id": str(existing_doc.document_id)
-            }
+            upload.close()
+            response.status_code = status.HTTP_200_OK
+            return _duplicate_response(existing_doc)
         
         # Generate unique filename
-        timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+        upload_date = datetime.utcnow()
+        timestamp = upload_date.strftime("%Y%m%d_%H%M%S")
         safe_filename = f"{timestamp}_{file.filename}"
         
         # Create document record
         document = Document(
-            org_id=current_user.org_id,
+            org_id=current_user["org_id"],
             filename=safe_filename,
             original_filename=file.filename,
             file_type=file_extension,
             file_size=file_size,
-            file_path=f"uploads/{current_user.org_id}/{safe_filename}",
+            file_path=f"uploads/{current_user['org_id']}/{safe_filename}",
             processing_status="processing",
-            uploaded_by=current_user.user_id,
+            uploaded_by=current_user["user_id"],
+            upload_date=upload_date,
             content_hash=content_hash,
             embedding_model="all-MiniLM-L6-v2",
             doc_metadata={
                 "uploaded_via": "admin_api",
-                "uploader_email": current_user.email
+                "uploader_email": current_user["email"]
             }
         )
         
         db.add(document)
-        db.flush()  # Get the document_id
+        await update_daily_stats(db, current_user["org_id"], upload_date.date(), 1, file_size)
+        await db.commit()
+        schedule_org_stats_refresh(current_user["org_id"])
+        await analytics_cache.invalidate_org(current_user["org_id"])
         
-        # Process document content
-        text_content = ""
-        if file_extension == 'txt' or file_extension == 'text':
-            text_content = content.decode('utf-8')
-        elif file_extension == 'pdf':
-            try:
-                import PyPDF2
-                import io
-                pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
-                text_content = "\\n".join([page.extract_text() for page in pdf_reader.pages])
-            except Exception as e:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Error processing PDF: {str(e)}"
-                )
-        elif file_extension == 'docx':
-            try:
-                from docx import Document as DocxDocument
-                import io
-                docx_doc = DocxDocument(io.BytesIO(content))
-                text_content = "\\n".join([paragraph.text for paragraph in docx_doc.paragraphs])
-            except Exception as e:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Error processing DOCX: {str(e)}"
-                )
-        
-        # Update document with extracted text length
-        document.extracted_text_length = len(text_content)
-        
-        # Split text into chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
-        )
-        
-        chunks = text_splitter.split_text(text_content)
-        
-        # Create Langchain documents
-        langchain_docs = [
-            LangchainDocument(
-                page_content=chunk,
-                metadata={
-                    "source": document.filename,
-                    "document_id": str(document.document_id),
-                    "chunk_index": i,
-                    "file_type": file_extension,
-                    "org_id": str(current_user.org_id)
-                }
-            )
-            for i, chunk in enumerate(chunks)
-        ]
-        
-        # Add to vector store
-        vector_result = vector_store.add_documents(
-            org_id=current_user.org_id,
-            documents=langchain_docs,
-            document_id=document.document_id
+        # Extraction, chunking and embedding run after the response is sent
+        background_tasks.add_task(
+            process_document_async,
+            document.document_id,
+            upload,
+            file_extension,
+            current_user["org_id"],
+            vector_store
         )
         
-        if vector_result["success"]:
-            document.processing_status = "completed"
-            document.chunks_created = vector_result["chunks_added"]
-            document.processed_date = datetime.utcnow()
-        else:
-            document.processing_status = "failed"
-            
-        db.commit()
-        
         return {
             "status": "success",
             "document_id": str(document.document_id),
             "filename": document.filename,
             "file_type": file_extension,
             "file_size": file_size,
-            "chunks_created": document.chunks_created,
+            "chunks_created": 0,
             "processing_status": document.processing_status,
-            "org_id": str(current_user.org_id)
+            "org_id": str(current_user["org_id"])
         }
         
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        if upload is not None:
+            upload.close()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error processing document: {str(e)}"
@@ -196,33 +363,52 @@ async def upload_document(
 @router.get("/list")
 async def list_documents(
     current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """List all documents in organization"""
     try:
-        documents = db.query(Document).filter(
-            Document.org_id == current_user["org_id"]
-        ).order_by(Document.upload_date.desc()).all()
+        # Project only the columns the response needs, uploader name via LEFT JOIN
+        result = await db.execute(
+            select(
+                Document.document_id,
+                Document.original_filename,
+                Document.file_type,
+                Document.file_size,
+                Document.chunks_created,
+                Document.processing_status,
+                Document.upload_date,
+                Document.processed_date,
+                User.full_name.label('uploader_name')
+            ).outerjoin(
+                User, Document.uploaded_by == User.user_id
+            ).where(
+                Document.org_id == current_user["org_id"]
+            ).order_by(Document.upload_date.desc())
+        )
+        rows = result.all()
         
-        doc_list = []
-        for doc in documents:
-            doc_list.append({
-                "document_id": str(doc.document_id),
-                "filename": doc.original_filename,
-                "file_type": doc.file_type,
-                "file_size": doc.file_size,
-                "chunks_created": doc.chunks_created,
-                "processing_status": doc.processing_status,
-                "upload_date": doc.upload_date.isoformat(),
-                "processed_date": doc.processed_date.isoformat() if doc.processed_date else None,
-                "uploader": doc.uploader.full_name if doc.uploader else "Unknown"
-            })
+        # orjson serializes UUID and datetime natively, so rows go out without per-field conversion
+        doc_list = [
+            {
+                "document_id": row.document_id,
+                "filename": row.original_filename,
+                "file_type": row.file_type,
+                "file_size": row.file_size,
+                "chunks_created": row.chunks_created,
+                "processing_status": row.processing_status,
+                "upload_date": row.upload_date,
+                "processed_date": row.processed_date,
+                "uploader": row.uploader_name or "Unknown"
+            }
+            for row in rows
+        ]
         
-        return {
+        # Returned as a response directly to skip jsonable_encoder on large listings
+        return ORJSONResponse({
             "documents": doc_list,
             "total": len(doc_list),
-            "org_id": str(current_user.org_id)
-        }
+            "org_id": str(current_user["org_id"])
+        })
         
     except Exception as e:
         raise HTTPException(
@@ -233,13 +419,13 @@ async def list_documents(
 @router.delete("/{document_id}")
 async def delete_document(
     document_id: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
     vector_store: MultiTenantVectorStore = Depends(get_vector_store)
 ):
     """Delete document from organization's knowledge base"""
     # Check admin permissions
-    if current_user.role != "admin":
+    if current_user["role"] != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Only admin users can delete documents"
@@ -255,10 +441,13 @@ async def delete_document(
     
     try:
         # Find document
-        document = db.query(Document).filter(
-            Document.document_id == doc_uuid,
-            Document.org_id == current_user.org_id
-        ).first()
+        result = await db.execute(
+            select(Document).where(
+                Document.document_id == doc_uuid,
+                Document.org_id == current_user["org_id"]
+            )
+        )
+        document = result.scalars().first()
         
         if not document:
             raise HTTPException(
@@ -266,15 +455,21 @@ async def delete_document(
                 detail="Document not found"
             )
         
-        # Delete from vector store
-        vector_result = vector_store.delete_document(
-            org_id=current_user.org_id,
+        # Delete from vector store; Chroma I/O blocks, keep it off the event loop
+        vector_result = await asyncio.to_thread(
+            vector_store.delete_document,
+            org_id=current_user["org_id"],
             document_id=doc_uuid
         )
         
         # Delete from database
-        db.delete(document)
-        db.commit()
+        await db.delete(document)
+        await update_daily_stats(
+            db, current_user["org_id"], document.upload_date.date(), -1, -document.file_size
+        )
+        await db.commit()
+        schedule_org_stats_refresh(current_user["org_id"])
+        await analytics_cache.invalidate_org(current_user["org_id"])
         
         return {
             "status": "success",
@@ -285,7 +480,7 @@ async def delete_document(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error deleting document: {str(e)}"
@@ -293,28 +488,27 @@ async def delete_document(
 
 @router.get("/stats")
 async def get_document_stats(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
     vector_store: MultiTenantVectorStore = Depends(get_vector_store)
 ):
     """Get document statistics for organization"""
     try:
-        # Database stats
-        total_docs = db.query(Document).filter(
-            Document.org_id == current_user.org_id
-        ).count()
-        
-        completed_docs = db.query(Document).filter(
-            Document.org_id == current_user.org_id,
-            Document.processing_status == "completed"
-        ).count()
-        
-        total_size = db.query(db.func.sum(Document.file_size)).filter(
-            Document.org_id == current_user.org_id
-        ).scalar() or 0
+        # One aggregate for the DB side, overlapped with the (blocking) vector store lookup
+        db_query = db.execute(
+            select(
+                func.count(Document.document_id).label('total'),
+                func.count(case((Document.processing_status == "completed", 1))).label('completed'),
+                func.coalesce(func.sum(Document.file_size), 0).label('total_size')
+            ).where(Document.org_id == current_user["org_id"])
+        )
+        vector_query = asyncio.to_thread(vector_store.get_org_stats, current_user["org_id"])
+        result, vector_stats = await asyncio.gather(db_query, vector_query)
         
-        # Vector store stats
-        vector_stats = vector_store.get_org_stats(current_user.org_id)
+        row = result.one()
+        total_docs = row.total
+        completed_docs = row.completed
+        total_size = row.total_size
         
         return {
             "total_documents": total_docs,
@@ -324,11 +518,51 @@ async def get_document_stats(
             "total_size_mb": round(total_size / (1024 * 1024), 2),
             "total_chunks": vector_stats.get("total_chunks", 0),
             "vector_store_collection": vector_stats.get("collection_name", ""),
-            "org_id": str(current_user.org_id)
+            "org_id": str(current_user["org_id"])
         }
         
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error getting document stats: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+@router.get("/{document_id}")
+async def get_document(
+    document_id: str,
+    current_user: Dict[str, Any] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get a single document's processing status"""
+    try:
+        doc_uuid = uuid.UUID(document_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid document ID format"
+        )
+    
+    result = await db.execute(
+        select(Document).where(
+            Document.document_id == doc_uuid,
+            Document.org_id == current_user["org_id"]
+        )
+    )
+    document = result.scalars().first()
+    
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document not found"
+        )
+    
+    return {
+        "document_id": document.document_id,
+        "filename": document.original_filename,
+        "file_type": document.file_type,
+        "file_size": document.file_size,
+        "chunks_created": document.chunks_created,
+        "processing_status": document.processing_status,
+        "upload_date": document.upload_date,
+        "processed_date": document.processed_date
+    }
\ No newline at end of file
@@ -2,10 +2,11 @@
 API routes for organization management
 """
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
+import uuid
 
-from database.database import get_db
+from database.database import get_async_db
 from schemas.organizations import (
     OrganizationCreate, 
     OrganizationResponse, 
@@ -20,14 +21,14 @@ router = APIRouter(prefix="/organizations", tags=["Organizations"])
 @router.post("/register", response_model=OrganizationRegistrationResponse)
 async def register_organization(
     org_data: OrganizationCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Register a new organization with admin user
     This is the main entry point for new organizations
     """
     service = OrganizationService(db)
-    result = service.create_organization(org_data)
+    result = await service.create_organization(org_data)
     
     if not result["success"]:
         raise HTTPException(
@@ -46,20 +47,20 @@ async def register_organization(
 @router.get("/{org_id}", response_model=OrganizationResponse)
 async def get_organization(
     org_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get organization details"""
     service = OrganizationService(db)
     
     try:
-        org = service.get_organization(org_id)
+        org = await service.get_organization(uuid.UUID(org_id))
         if not org:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Organization not found"
             )
         
-        return OrganizationResponse.from_orm(org)
+        return OrganizationResponse.model_validate(org)
         
     except ValueError:
         raise HTTPException(
@@ -71,13 +72,13 @@ async def get_organization(
 async def update_organization(
     org_id: str,
     updates: OrganizationUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update organization settings"""
     service = OrganizationService(db)
     
     try:
-        result = service.update_organization(org_id, updates)
+        result = await service.update_organization(uuid.UUID(org_id), updates)
         
         if not result["success"]:
             raise HTTPException(
@@ -96,13 +97,13 @@ async def update_organization(
 @router.get("/{org_id}/stats", response_model=OrganizationStats)
 async def get_organization_stats(
     org_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get organization statistics and usage data"""
     service = OrganizationService(db)
     
     try:
-        stats = service.get_organization_stats(org_id)
+        stats = await service.get_organization_stats(uuid.UUID(org_id))
         
         if "error" in stats:
             raise HTTPException(
@@ -121,13 +122,13 @@ async def get_organization_stats(
 @router.delete("/{org_id}")
 async def deactivate_organization(
     org_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Deactivate an organization (soft delete)"""
     service = OrganizationService(db)
     
     try:
-        result = service.deactivate_organization(org_id)
+        result = await service.deactivate_organization(uuid.UUID(org_id))
         
         if not result["success"]:
             raise HTTPException(
@@ -146,11 +147,11 @@ async def deactivate_organization(
 @router.get("/domain/{domain}", response_model=OrganizationResponse)
 async def get_organization_by_domain(
     domain: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get organization by custom domain"""
     service = OrganizationService(db)
-    org = service.get_organization_by_domain(domain)
+    org = await service.get_organization_by_domain(domain)
     
     if not org:
         raise HTTPException(
@@ -158,4 +159,4 @@ async def get_organization_by_domain(
             detail=f"No organization found for domain '{domain}'"
         )
     
-    return OrganizationResponse.from_orm(org)
\ No newline at end of file
+    return OrganizationResponse.model_validate(org)
\ No newline at end of file
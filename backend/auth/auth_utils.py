@@ -1,5 +1,6 @@
 import os
 import jwt
+import functools
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from passlib.context import CryptContext
@@ -10,8 +11,17 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-# Password encryption
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing: new hashes are Argon2id, existing bcrypt hashes still verify
+# and are flagged for rehash (deprecated="auto")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    argon2__memory_cost=19456,  # KiB
+    argon2__time_cost=2,
+    argon2__parallelism=1
+)
 
 # JWT settings
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
@@ -22,10 +32,16 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
 ADMIN_PASSWORD_HASH = os.getenv("ADMIN_PASSWORD_HASH")
 
-# If no hash is provided, create one for default password "admin123"
-if not ADMIN_PASSWORD_HASH:
-    ADMIN_PASSWORD_HASH = pwd_context.hash("admin123")
+if not ADMIN_PASSWORD_HASH and os.getenv("ENVIRONMENT", "development") == "production":
+    raise RuntimeError("ADMIN_PASSWORD_HASH must be set in production")
+
+@functools.lru_cache(maxsize=1)
+def _get_admin_hash() -> str:
+    """Admin password hash, falling back to a default "admin123" hash built on first use"""
+    if ADMIN_PASSWORD_HASH:
+        return ADMIN_PASSWORD_HASH
     logger.warning("Using default admin password 'admin123'. Change this in production!")
+    return pwd_context.hash("admin123")
 
 security = HTTPBearer()
 
@@ -41,7 +57,7 @@ def authenticate_admin(username: str, password: str) -> bool:
     """Authenticate admin user"""
     if username != ADMIN_USERNAME:
         return False
-    return verify_password(password, ADMIN_PASSWORD_HASH)
+    return verify_password(password, _get_admin_hash())
 
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     """Create JWT access token"""
@@ -90,15 +106,3 @@ async def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
         )
-
-class AdminRequired:
-    """Dependency class for admin authentication"""
-    
-    def __init__(self):
-        pass
-    
-    async def __call__(self, current_admin: str = Depends(get_current_admin)) -> str:
-        return current_admin
-
-# Create instance for dependency injection
-admin_required = AdminRequired()
\ No newline at end of file
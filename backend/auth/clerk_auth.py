@@ -2,11 +2,16 @@
 Clerk authentication utilities for backend JWT validation
 """
 import os
+import time
+import asyncio
+import hashlib
 from typing import Optional, Dict, Any
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import httpx
-from jose import jwt, JWTError
+from jose import jwt, jwk, JWTError
+from jose.backends.base import Key
+from cachetools import TTLCache
 import logging
 
 logger = logging.getLogger(__name__)
@@ -20,37 +25,105 @@ if not CLERK_SECRET_KEY:
 
 security = HTTPBearer()
 
+# How long fetched signing keys are trusted before re-fetching
+JWKS_CACHE_TTL = int(os.getenv("CLERK_JWKS_CACHE_TTL", "600"))
+JWKS_MIN_REFRESH_INTERVAL = 30
+
+# Verified token payloads, keyed by token hash; entries never outlive the token's exp
+TOKEN_CACHE_TTL = int(os.getenv("CLERK_TOKEN_CACHE_TTL", "30"))
+_payload_cache: TTLCache = TTLCache(maxsize=10000, ttl=TOKEN_CACHE_TTL)
+
+# Shared client so JWKS refetches reuse a warm connection to Clerk
+_http_client: Optional[httpx.AsyncClient] = None
+
+async def startup() -> None:
+    """Open the shared HTTP client; called from the app lifespan"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=5.0,
+            limits=httpx.Limits(max_keepalive_connections=10)
+        )
+
+async def shutdown() -> None:
+    """Close the shared HTTP client"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+def _token_cache_key(token: str) -> str:
+    """Hash the token so raw bearer tokens aren't held in memory as keys"""
+    return hashlib.sha256(token.encode()).hexdigest()[:32]
+
 class ClerkJWTBearer:
     """Clerk JWT token validator"""
     
     def __init__(self):
-        self.jwks_cache = None
+        self.keys_by_kid: Dict[str, Key] = {}
+        self.jwks_fetched_at = 0.0
+        self.jwks_lock = asyncio.Lock()
         self.algorithm = "RS256"
     
-    async def get_jwks(self) -> Dict[str, Any]:
-        """Fetch JWKS from Clerk"""
-        if self.jwks_cache:
-            return self.jwks_cache
+    async def get_jwks(self, force_refresh: bool = False) -> Dict[str, Key]:
+        """Fetch JWKS from Clerk as parsed keys indexed by kid, cached for JWKS_CACHE_TTL seconds"""
+        if not force_refresh and self._jwks_fresh():
+            return self.keys_by_kid
+        
+        # Single flight: concurrent misses wait for one fetch instead of all hitting Clerk
+        async with self.jwks_lock:
+            if not force_refresh and self._jwks_fresh():
+                return self.keys_by_kid
+            if force_refresh and time.monotonic() - self.jwks_fetched_at < JWKS_MIN_REFRESH_INTERVAL:
+                # Unknown kids can't force a fetch per request
+                return self.keys_by_kid
             
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(CLERK_JWKS_URL)
+            try:
+                if _http_client is None:
+                    # Outside the app lifespan (scripts, tests)
+                    await startup()
+                response = await _http_client.get(CLERK_JWKS_URL)
                 response.raise_for_status()
-                self.jwks_cache = response.json()
-                return self.jwks_cache
-        except Exception as e:
-            logger.error(f"Failed to fetch JWKS: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to validate token"
-            )
+                jwks = response.json()
+            except Exception as e:
+                logger.error(f"Failed to fetch JWKS: {e}")
+                if self.keys_by_kid:
+                    # Keep serving the last known keys if Clerk is briefly unreachable
+                    return self.keys_by_kid
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="Failed to validate token"
+                )
+            
+            # Parse each JWK once here; jwt.decode would otherwise rebuild the RSA key on every call
+            keys_by_kid = {}
+            for jwk_key in jwks.get("keys", []):
+                if not jwk_key.get("kid"):
+                    continue
+                try:
+                    keys_by_kid[jwk_key["kid"]] = jwk.construct(jwk_key, self.algorithm)
+                except Exception as e:
+                    logger.warning(f"Skipping unusable JWKS key {jwk_key['kid']}: {e}")
+            
+            self.keys_by_kid = keys_by_kid
+            self.jwks_fetched_at = time.monotonic()
+            return self.keys_by_kid
+    
+    def _jwks_fresh(self) -> bool:
+        """Whether cached keys exist and are within JWKS_CACHE_TTL"""
+        return bool(self.keys_by_kid) and time.monotonic() - self.jwks_fetched_at < JWKS_CACHE_TTL
     
     async def verify_token(self, token: str) -> Dict[str, Any]:
         """Verify Clerk JWT token"""
+        cache_key = _token_cache_key(token)
+        cached = _payload_cache.get(cache_key)
+        if cached is not None:
+            payload, expires_at = cached
+            if expires_at > time.time():
+                return payload
+            _payload_cache.pop(cache_key, None)
+        
         try:
-            # Get JWKS for signature verification
-            jwks = await self.get_jwks()
-            
             # Decode header to get key ID
             unverified_header = jwt.get_unverified_header(token)
             key_id = unverified_header.get("kid")
@@ -61,12 +134,13 @@ class ClerkJWTBearer:
                     detail="Invalid token header"
                 )
             
-            # Find the matching key
-            key = None
-            for jwk_key in jwks.get("keys", []):
-                if jwk_key.get("kid") == key_id:
-                    key = jwk_key
-                    break
+            # Find the matching key: a dict hit on the steady-state path, refreshing
+            # once in case Clerk rotated keys
+            key = self.keys_by_kid.get(key_id) if self._jwks_fresh() else None
+            if not key:
+                key = (await self.get_jwks()).get(key_id)
+            if not key:
+                key = (await self.get_jwks(force_refresh=True)).get(key_id)
             
             if not key:
                 raise HTTPException(
@@ -79,11 +153,20 @@ class ClerkJWTBearer:
                 token,
                 key,
                 algorithms=[self.algorithm],
-                options={"verify_aud": False}  # Clerk doesn't use standard aud claim
+                options={
+                    "verify_aud": False,  # Clerk doesn't use standard aud claim
+                    # Missing claims fail inside the verified decode instead of being checked afterwards
+                    "require_sub": True,
+                    "require_exp": True
+                }
             )
             
+            _payload_cache[cache_key] = (payload, payload["exp"])
+            
             return payload
             
+        except HTTPException:
+            raise
         except JWTError as e:
             logger.error(f"JWT validation error: {e}")
             raise HTTPException(
@@ -110,24 +193,16 @@ async def get_current_user_clerk(
     token = credentials.credentials
     payload = await clerk_jwt.verify_token(token)
     
-    # Extract user information from Clerk token
-    user_info = {
-        "user_id": payload.get("sub"),  # Subject is user ID in Clerk
+    # Extract user information from Clerk token (sub/exp presence enforced by verify_token)
+    return {
+        "user_id": payload["sub"],  # Subject is user ID in Clerk
         "email": payload.get("email"),
         "org_id": payload.get("org_id"),
         "org_role": payload.get("org_role"),
         "session_id": payload.get("sid"),
         "issued_at": payload.get("iat"),
-        "expires_at": payload.get("exp")
+        "expires_at": payload["exp"]
     }
-    
-    if not user_info["user_id"]:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid user token"
-        )
-    
-    return user_info
 
 # Backward compatibility function for existing endpoints
 async def get_current_user_compatible(
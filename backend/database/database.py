@@ -1,12 +1,22 @@
 """
 Database configuration and session management
 """
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import sessionmaker, scoped_session, Session
 from sqlalchemy.pool import StaticPool
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import os
-from typing import Generator
-from .models import Base
+import asyncio
+import logging
+from typing import Generator, AsyncGenerator, Optional, Set, Any
+from datetime import date
+import uuid
+from .models import Base, DocumentDailyStats
+from services.analytics_cache import analytics_cache
+
+logger = logging.getLogger(__name__)
 
 # Database configuration
 DATABASE_URL = os.getenv(
@@ -14,6 +24,19 @@ DATABASE_URL = os.getenv(
     "sqlite:///./insightflow_multitenant.db"  # Default to SQLite for development
 )
 
+# Statement logging is expensive per query; opt in with SQL_ECHO=1 when debugging
+SQL_ECHO = os.getenv("SQL_ECHO", "0") == "1"
+
+# Connection pool settings for non-SQLite databases
+# Sized for ~100 concurrent requests holding a connection for a couple of queries each
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "40"))
+POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_TIMEOUT_SECONDS = int(os.getenv("DB_POOL_TIMEOUT", "10"))  # fail fast instead of queueing for 30s
+
+# Seconds a document mutation waits before the stats view is refreshed; writes in the window share one refresh
+ORG_STATS_REFRESH_DELAY = float(os.getenv("ORG_STATS_REFRESH_DELAY", "30"))
+
 # Create engine with appropriate settings
 if DATABASE_URL.startswith("sqlite"):
     # SQLite specific settings
@@ -21,45 +44,176 @@ if DATABASE_URL.startswith("sqlite"):
         DATABASE_URL,
         connect_args={"check_same_thread": False},
         poolclass=StaticPool,
-        echo=True  # Set to False in production
+        echo=SQL_ECHO,
+        echo_pool=False
     )
 else:
     # PostgreSQL or other databases
     engine = create_engine(
         DATABASE_URL,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_recycle=POOL_RECYCLE_SECONDS,
+        pool_timeout=POOL_TIMEOUT_SECONDS,
         pool_pre_ping=True,
-        echo=True  # Set to False in production
+        echo=SQL_ECHO,
+        echo_pool=False
     )
 
 # Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Thread-local registry for sync code (scripts, worker threads): repeated calls
+# in one thread share a session until SessionLocal.remove()
+SessionLocal = scoped_session(session_factory)
+
+def _async_database_url(url: str) -> str:
+    """Map a sync database URL onto its async driver"""
+    if url.startswith("sqlite:///"):
+        return url.replace("sqlite:///", "sqlite+aiosqlite:///", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql+asyncpg://", 1)
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_database_url(DATABASE_URL))
+
+# Async engine for request handlers so queries don't block the event loop
+if ASYNC_DATABASE_URL.startswith("sqlite"):
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        echo=SQL_ECHO,
+        echo_pool=False
+    )
+else:
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_recycle=POOL_RECYCLE_SECONDS,
+        pool_timeout=POOL_TIMEOUT_SECONDS,
+        pool_pre_ping=True,
+        echo=SQL_ECHO,
+        echo_pool=False
+    )
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
 
 def create_tables():
     """Create all tables in the database"""
     Base.metadata.create_all(bind=engine)
 
+# Cached on first check; the view only appears when migrations run, which means a restart
+_org_stats_view_exists: Optional[bool] = None
+_org_stats_refresh_task: Optional[asyncio.Task] = None
+# Orgs changed since the last refresh; their cached analytics are dropped once it lands
+_org_stats_pending_orgs: Set[Any] = set()
+
+async def uses_org_stats_view(db: AsyncSession) -> bool:
+    """Whether the per-org stats materialized view exists (PostgreSQL with migrations applied)"""
+    global _org_stats_view_exists
+    if db.bind.dialect.name != "postgresql":
+        return False
+    
+    if _org_stats_view_exists is None:
+        result = await db.execute(text("SELECT to_regclass('mv_org_document_stats') IS NOT NULL"))
+        _org_stats_view_exists = bool(result.scalar())
+        if not _org_stats_view_exists:
+            logger.warning("mv_org_document_stats not found, computing org stats live; run alembic upgrade")
+    return _org_stats_view_exists
+
+async def _refresh_org_stats_view() -> None:
+    """Refresh the per-org document stats view after the debounce delay"""
+    global _org_stats_refresh_task
+    await asyncio.sleep(ORG_STATS_REFRESH_DELAY)
+    # Mutations from here on schedule a fresh refresh instead of relying on this one
+    _org_stats_refresh_task = None
+    org_ids = list(_org_stats_pending_orgs)
+    _org_stats_pending_orgs.clear()
+    try:
+        async with AsyncSessionLocal() as db:
+            if not await uses_org_stats_view(db):
+                return
+            await db.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY mv_org_document_stats"))
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Org stats view refresh failed: {e}")
+        return
+    
+    # Responses cached between the mutation and now were built from the old view rows
+    for org_id in org_ids:
+        await analytics_cache.invalidate_org(org_id)
+
+def schedule_org_stats_refresh(org_id: Any) -> None:
+    """
+    Queue a refresh of the per-org document stats view off the request path
+    Call after document mutations to org_id have been committed
+    """
+    global _org_stats_refresh_task
+    if async_engine.dialect.name != "postgresql":
+        return
+    
+    _org_stats_pending_orgs.add(org_id)
+    if _org_stats_refresh_task is None:
+        _org_stats_refresh_task = asyncio.create_task(_refresh_org_stats_view())
+
+async def update_daily_stats(
+    db: AsyncSession,
+    org_id: uuid.UUID,
+    day: date,
+    count_delta: int,
+    size_delta: int
+) -> None:
+    """
+    Apply an upload (+1) or delete (-1) to the daily rollup row for org/day
+    Runs inside the caller's transaction; commit alongside the document change
+    """
+    insert = pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+    stmt = insert(DocumentDailyStats).values(
+        org_id=org_id,
+        day=day,
+        document_count=count_delta,
+        total_size=size_delta
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DocumentDailyStats.org_id, DocumentDailyStats.day],
+        set_={
+            "document_count": DocumentDailyStats.document_count + stmt.excluded.document_count,
+            "total_size": DocumentDailyStats.total_size + stmt.excluded.total_size
+        }
+    )
+    await db.execute(stmt)
+
 def get_db() -> Generator[Session, None, None]:
     """
     Dependency for getting database session
     Use with FastAPI Depends()
     """
-    db = SessionLocal()
+    # Not the scoped registry: FastAPI may run a sync dependency's setup and
+    # teardown on different threadpool threads, so remove() could hit another request
+    db = session_factory()
     try:
         yield db
     finally:
         db.close()
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Dependency for getting async database session
+    Use with FastAPI Depends() in async handlers
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def get_db_session() -> Session:
     """
-    Get database session for direct use
-    Remember to close the session when done
+    Get the current thread's database session for direct use
+    Call SessionLocal.remove() when the thread's work is done
     """
     return SessionLocal()
-
-# Initialize database on import (for development)
-if os.getenv("ENVIRONMENT", "development") == "development":
-    try:
-        create_tables()
-        print("✅ Database tables created successfully")
-    except Exception as e:
-        print(f"❌ Error creating database tables: {e}")
\ No newline at end of file
@@ -1,15 +1,33 @@
 """
 Multi-tenant database models for RAG Platform
 """
-from sqlalchemy import Column, String, DateTime, Integer, Text, Boolean, ForeignKey, JSON, Float
+from sqlalchemy import Column, String, DateTime, Date, Integer, BigInteger, Text, Boolean, ForeignKey, JSON, Float, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.dialects.postgresql import UUID, JSONB
 import uuid
-from datetime import datetime
 
 Base = declarative_base()
 
+class utcnow(FunctionElement):
+    """Database-side UTC timestamp, so rows are stamped by one clock instead of each worker's"""
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(utcnow, "postgresql")
+def _pg_utcnow(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+@compiles(utcnow)
+def _default_utcnow(element, compiler, **kw):
+    # SQLite's CURRENT_TIMESTAMP is already UTC
+    return "CURRENT_TIMESTAMP"
+
+# Binary JSONB on PostgreSQL (no re-parse on read, GIN-indexable); plain JSON elsewhere
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
 class Organization(Base):
     """Organization/Tenant entity"""
     __tablename__ = "organizations"
@@ -18,10 +36,10 @@ class Organization(Base):
     org_name = Column(String(255), nullable=False)
     domain = Column(String(255), unique=True, nullable=True)  # Optional custom domain
     plan_type = Column(String(50), default="starter")  # starter, professional, enterprise
-    settings = Column(JSON, default={})  # RAG config, LLM preferences, etc.
+    settings = Column(JSONType, default=dict)  # RAG config, LLM preferences, etc.
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utcnow())
+    updated_at = Column(DateTime, server_default=utcnow(), onupdate=utcnow())
     
     # Relationships
     users = relationship("User", back_populates="organization", cascade="all, delete-orphan")
@@ -40,12 +58,17 @@ class User(Base):
     password_hash = Column(String(255), nullable=True)  # For JWT auth
     is_active = Column(Boolean, default=True)
     last_login = Column(DateTime, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utcnow())
+    updated_at = Column(DateTime, server_default=utcnow(), onupdate=utcnow())
     
     # Relationships
     organization = relationship("Organization", back_populates="users")
     search_logs = relationship("SearchLog", back_populates="user", cascade="all, delete-orphan")
+    
+    # email is already indexed by its unique constraint
+    __table_args__ = (
+        Index("idx_users_org", org_id),
+    )
 
 class Document(Base):
     """Document entity with organization isolation"""
@@ -66,18 +89,41 @@ class Document(Base):
     
     # Upload metadata
     uploaded_by = Column(UUID(as_uuid=True), ForeignKey("users.user_id"), nullable=False)
-    upload_date = Column(DateTime, default=datetime.utcnow)
+    upload_date = Column(DateTime, server_default=utcnow())
     processed_date = Column(DateTime, nullable=True)
     
     # Content metadata
-    content_hash = Column(String(64), nullable=True)  # SHA-256 for deduplication
+    content_hash = Column(String(64), nullable=True)  # BLAKE3 for deduplication
     extracted_text_length = Column(Integer, default=0)
-    doc_metadata = Column(JSON, default={})  # custom metadata, tags, etc.
+    doc_metadata = Column(JSONType, default=dict)  # custom metadata, tags, etc.
     
     # Relationships
     organization = relationship("Organization", back_populates="documents")
-    uploader = relationship("User")
+    uploader = relationship("User", lazy="raise_on_sql")  # join explicitly; per-row lookups are an N+1
     embeddings = relationship("DocumentEmbedding", back_populates="document", cascade="all, delete-orphan")
+    
+    # Covering indexes for per-org analytics (INCLUDE columns are PostgreSQL only)
+    __table_args__ = (
+        Index(
+            "idx_docs_org_status", org_id, processing_status,
+            postgresql_include=["file_size", "chunks_created"]
+        ),
+        Index(
+            "idx_docs_org_upload", org_id, upload_date.desc(),
+            postgresql_include=["file_size", "file_type"]
+        ),
+        Index("idx_docs_uploaded_by", uploaded_by),
+        Index("idx_docs_metadata_gin", doc_metadata, postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
+
+class DocumentDailyStats(Base):
+    """Daily document upload rollup per organization, maintained on upload/delete"""
+    __tablename__ = "document_daily_stats"
+    
+    org_id = Column(UUID(as_uuid=True), ForeignKey("organizations.org_id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    document_count = Column(Integer, nullable=False, default=0)
+    total_size = Column(BigInteger, nullable=False, default=0)  # bytes
 
 class DocumentEmbedding(Base):
     """Vector embeddings for document chunks"""
@@ -90,17 +136,22 @@ class DocumentEmbedding(Base):
     # Chunk data
     chunk_index = Column(Integer, nullable=False)  # position in document
     chunk_text = Column(Text, nullable=False)
-    chunk_metadata = Column(JSON, default={})  # page number, section, etc.
+    chunk_metadata = Column(JSONType, default=dict)  # page number, section, etc.
     
     # Vector data (stored in ChromaDB, referenced here)
     chroma_id = Column(String(255), nullable=False)  # ID in ChromaDB
     embedding_model = Column(String(100), nullable=False)
     
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utcnow())
     
     # Relationships
     document = relationship("Document", back_populates="embeddings")
     organization = relationship("Organization")
+    
+    __table_args__ = (
+        Index("idx_embeddings_org_doc", org_id, document_id),
+        Index("idx_embeddings_doc", document_id),
+    )
 
 class UserSession(Base):
     """User session tracking with organization context"""
@@ -111,8 +162,8 @@ class UserSession(Base):
     org_id = Column(UUID(as_uuid=True), ForeignKey("organizations.org_id"), nullable=False)
     
     # Session metadata
-    created_at = Column(DateTime, default=datetime.utcnow)
-    last_active = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utcnow())
+    last_active = Column(DateTime, server_default=utcnow())
     is_active = Column(Boolean, default=True)
     user_agent = Column(String(500), nullable=True)
     ip_address = Column(String(45), nullable=True)  # IPv6 compatible
@@ -127,6 +178,11 @@ class UserSession(Base):
     user = relationship("User")
     organization = relationship("Organization")
     search_logs = relationship("SearchLog", back_populates="session", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        Index("idx_sessions_org", org_id),
+        Index("idx_sessions_user", user_id),
+    )
 
 class SearchLog(Base):
     """Search/query analytics and logging"""
@@ -148,20 +204,27 @@ class SearchLog(Base):
     # RAG specific data
     documents_retrieved = Column(Integer, default=0)
     max_similarity_score = Column(Float, nullable=True)
-    documents_used = Column(JSON, default=[])  # list of document_ids
+    documents_used = Column(JSONType, default=list)  # list of document_ids
     
     # User feedback
     user_rating = Column(Integer, nullable=True)  # 1-5 stars or thumbs up/down
     user_feedback = Column(Text, nullable=True)
     
     # Metadata
-    timestamp = Column(DateTime, default=datetime.utcnow)
-    search_metadata = Column(JSON, default={})
+    timestamp = Column(DateTime, server_default=utcnow())
+    search_metadata = Column(JSONType, default=dict)
     
     # Relationships
     session = relationship("UserSession", back_populates="search_logs")
     user = relationship("User", back_populates="search_logs")
     organization = relationship("Organization", back_populates="search_logs")
+    
+    __table_args__ = (
+        Index("idx_search_logs_org_ts", org_id, timestamp),
+        Index("idx_search_logs_session", session_id),
+        Index("idx_search_logs_user", user_id),
+        Index("idx_search_logs_ts", timestamp),
+    )
 
 class Usage(Base):
     """Usage tracking for billing and analytics"""
@@ -190,7 +253,11 @@ class Usage(Base):
     # Storage metrics
     vector_embeddings_count = Column(Integer, default=0)
     
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utcnow())
     
     # Relationships
-    organization = relationship("Organization")
\ No newline at end of file
+    organization = relationship("Organization")
+    
+    __table_args__ = (
+        Index("idx_usage_org_period", org_id, period_start),
+    )
@@ -0,0 +1,30 @@
+"""
+Settings and routing rules shared by the agent graphs
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Labels the classifier may answer with; each is also a routing key in the graph
+QUERY_TYPES = ("retrieval", "tool_use", "direct")
+
+# Keyword fallbacks for when the LLM classification is unusable; one pass over the question each
+RETRIEVAL_KEYWORDS = re.compile(
+    r"tax|deduction|business expense|regulation|legal|rule|requirement|compliance|gst|hst|freelancer",
+    re.IGNORECASE
+)
+TOOL_KEYWORDS = re.compile(
+    r"calculate|compute|what is|weather|price|current|today|recent|news",
+    re.IGNORECASE
+)
+ERROR_FALLBACK_KEYWORDS = re.compile(r"tax|deduction|business|legal|rule|regulation", re.IGNORECASE)
+
+# Worker threads for CPU-bound retrieval; unset uses the stdlib default (min(32, CPUs + 4))
+THREAD_POOL_SIZE = int(os.getenv("THREAD_POOL_SIZE", "0")) or None
+
+def create_retrieval_executor() -> ThreadPoolExecutor:
+    """Thread pool for embedding + FAISS search, which have no async API"""
+    return ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE)
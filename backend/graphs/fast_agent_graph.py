@@ -1,4 +1,4 @@
-from typing import TypedDict, List, Dict, Any, Optional
+from typing import TypedDict, List, Dict, Any, Optional, AsyncGenerator
 from langchain.schema import BaseMessage, HumanMessage, AIMessage
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_community.embeddings import SentenceTransformerEmbeddings
@@ -8,8 +8,17 @@ import os
 from dotenv import load_dotenv
 import logging
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
 import functools
+import re
+import ast
+import operator
+import threading
+from collections import deque
+from itertools import islice
+from cachetools import LRUCache, TTLCache
+import numpy as np
+
+from graphs.common import create_retrieval_executor
 
 # Load environment variables
 load_dotenv()
@@ -17,16 +26,157 @@ load_dotenv()
 # Setup logging
 logger = logging.getLogger(__name__)
 
+# Keyword routing rules, each matched in a single pass over the text
+RETRIEVAL_KEYWORDS = re.compile(
+    r"tax|deduction|business expense|regulation|legal|rule|requirement|compliance|gst|hst|freelancer"
+    r"|rate|bracket|income tax",
+    re.IGNORECASE
+)
+TOOL_KEYWORDS = re.compile(
+    r"calculate|compute|weather|price|current|recent|news|\+|%|percent"
+    r"|date|time|today|now|what day|what time",
+    re.IGNORECASE
+)
+# Whole words (not substrings, so "taxonomy" doesn't count) marking a retrieval topic to follow up on
+FOLLOW_UP_RETRIEVAL_TOKENS = frozenset({
+    "tax", "taxes", "deduction", "deductions", "business", "businesses",
+    "legal", "rule", "rules"
+})
+WORD_PATTERN = re.compile(r"[a-z]+")
+DATETIME_KEYWORDS = re.compile(r"date|today|now|what day", re.IGNORECASE)
+MATH_KEYWORDS = re.compile(r"[+\-*/]|calculate|compute", re.IGNORECASE)
+SEARCH_KEYWORDS = re.compile(r"weather|news|current events", re.IGNORECASE)
+# "15% of 200" / "15 percent of 200"
+PERCENT_OF_PATTERN = re.compile(
+    r"(\d+(?:\.\d+)?)\s*(?:%|percent)\s+of\s+(\d+(?:\.\d+)?)", re.IGNORECASE
+)
+# Runs of arithmetic characters; the longest one containing a digit is the expression
+ARITHMETIC_PATTERN = re.compile(r"[\d+\-*/().\s%]+")
+
+# Response prompts, filled with str.format per request
+CONTEXTUAL_RESPONSE_PROMPT = """
+Continue this natural conversation. The user just said: "{question}"
+
+{context}
+
+Important: If the user's response refers to options or choices you previously offered (like "general", "specific", "yes", "no"), understand which option they're choosing and respond accordingly. Don't ask the same clarifying questions again - they already answered.
+
+Respond naturally and directly based on their choice.
+"""
+
+DATE_TOOL_RESPONSE_PROMPT = """
+The user asked: "{question}"
+
+The current date tool returned: {date_info}
+
+CRITICAL: You MUST use this exact date information. Do NOT use any other date.
+Answer with the date from the tool result only.
+"""
+
+TOOL_RESULT_RESPONSE_PROMPT = """
+Answer this question using the tool result: "{question}"
+Tool result: {tool_result}
+IMPORTANT: Use only the information from the tool result.
+"""
+
+TOOL_CONTEXT_RESPONSE_PROMPT = """
+Answer this question using the tool result provided: "{question}"
+
+{context}
+
+IMPORTANT: Use the exact information from the tool result. Do not make up or guess information.
+"""
+
+RESPONSE_PROMPT = """
+Answer this question helpfully and naturally: "{question}"
+
+{context}
+"""
+
+# Operators the arithmetic evaluator accepts; no power, so input can't blow up
+ARITHMETIC_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+
+def _eval_arithmetic(node: ast.AST) -> float:
+    """Evaluate a parsed +, -, *, / expression tree"""
+    if isinstance(node, ast.Expression):
+        return _eval_arithmetic(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in ARITHMETIC_OPERATORS:
+        return ARITHMETIC_OPERATORS[type(node.op)](
+            _eval_arithmetic(node.left), _eval_arithmetic(node.right)
+        )
+    if isinstance(node, ast.UnaryOp) and type(node.op) in ARITHMETIC_OPERATORS:
+        return ARITHMETIC_OPERATORS[type(node.op)](_eval_arithmetic(node.operand))
+    raise ValueError("Unsupported arithmetic expression")
+
+
+def _evaluate_arithmetic(question: str) -> Optional[Dict[str, Any]]:
+    """Evaluate the arithmetic in a question, or None if there is none to parse"""
+    percent_of = PERCENT_OF_PATTERN.search(question)
+    if percent_of:
+        percent, base = percent_of.groups()
+        result = float(percent) * float(base) / 100
+        return {"result": result, "calculation": f"{percent}% of {base} = {result}"}
+    
+    candidates = [
+        run.strip() for run in ARITHMETIC_PATTERN.findall(question)
+        if any(c.isdigit() for c in run)
+    ]
+    # Numbers split by words or letters ("3 plus 4", "1e5*2") are the calculator tool's job
+    if len(candidates) != 1:
+        return None
+    expression = candidates[0]
+    
+    try:
+        tree = ast.parse(expression.replace("%", "/100"), mode="eval")
+        # A bare number is not a calculation
+        if not any(isinstance(node, (ast.BinOp, ast.UnaryOp)) for node in ast.walk(tree)):
+            return None
+        result = _eval_arithmetic(tree)
+    except (SyntaxError, ValueError, ZeroDivisionError):
+        return None
+    return {"result": result, "calculation": f"{expression} = {result}"}
+
+# Question embeddings kept in memory; short follow-ups ("yes", "more") recur constantly
+EMBEDDING_CACHE_SIZE = 1024
+
+# Exchanges kept per conversation, and how many of the newest feed the prompts
+MEMORY_MAX_EXCHANGES = 10
+RECENT_EXCHANGES = 3
+# Characters of each answer kept in memory
+MEMORY_ANSWER_CHARS = 800
+# A question this similar (cosine) to a recent one replaces that exchange instead of adding another
+MEMORY_DEDUPE_THRESHOLD = 0.85
+
+# Conversations idle longer than this many seconds are forgotten
+CONVERSATION_MEMORY_TTL = int(os.getenv("CONVERSATION_MEMORY_TTL", "3600"))
+CONVERSATION_MEMORY_SIZE = 10_000
+
+# "onnx" runs MiniLM on ONNX Runtime (needs optimum[onnxruntime]); torch stays the default
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# e.g. onnx/model_qint8_avx512_vnni.onnx for the int8-quantized export shipped with the model
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE")
+
 class AgentState(TypedDict):
     messages: List[BaseMessage]
     question: str
     retrieved_docs: List[Dict[str, Any]]
-    analysis: str
     response: str
     steps: List[Dict[str, Any]]
     conversation_id: str
     query_type: str
-    conversation_history: List[Dict[str, Any]]
+    conversation_history: deque
+    recent_context: str
+    embedding_prefetch: Optional[asyncio.Future]
 
 class FastInsightFlowAgent:
     _instance = None
@@ -59,11 +209,22 @@ class FastInsightFlowAgent:
         
         # Initialize embeddings (cached)
         self.embeddings = SentenceTransformerEmbeddings(
-            model_name="all-MiniLM-L6-v2"
+            model_name="all-MiniLM-L6-v2",
+            model_kwargs=self._embedding_model_kwargs()
         )
         
-        # Simple memory storage
-        self.conversation_memory = {}
+        # Question embeddings keyed by normalized text; filled from executor threads
+        self.embedding_cache = LRUCache(maxsize=EMBEDDING_CACHE_SIZE)
+        self.embedding_cache_lock = threading.Lock()
+        
+        # Simple memory storage: conversation_id -> {"history": deque of the newest
+        # exchanges, "recent_lower": lowercased classifier context, "recent_context":
+        # prompt context for generate_response; both rebuilt on write}.
+        # Bounded and expiring so idle conversations don't accumulate; only touched
+        # from the event loop, so no lock
+        self.conversation_memory = TTLCache(
+            maxsize=CONVERSATION_MEMORY_SIZE, ttl=CONVERSATION_MEMORY_TTL
+        )
         
         # Load components
         self._load_components()
@@ -71,8 +232,7 @@ class FastInsightFlowAgent:
         # Build graph
         self.graph = self._build_graph()
         
-        # Thread pool for parallel processing
-        self.executor = ThreadPoolExecutor(max_workers=3)
+        self.executor = create_retrieval_executor()
         
         self._initialized = True
         logger.info("FastInsightFlowAgent initialized successfully")
@@ -91,6 +251,110 @@ class FastInsightFlowAgent:
             logger.error(f"Error loading components: {e}")
             raise
 
+    @staticmethod
+    def _embedding_model_kwargs() -> Dict[str, Any]:
+        """SentenceTransformer kwargs for the configured inference backend"""
+        if EMBEDDING_BACKEND == "torch":
+            return {}
+        kwargs: Dict[str, Any] = {"backend": EMBEDDING_BACKEND}
+        if EMBEDDING_ONNX_FILE:
+            kwargs["model_kwargs"] = {"file_name": EMBEDDING_ONNX_FILE}
+        return kwargs
+
+    def _embed_cached(self, text: str) -> List[float]:
+        """Embed a question, reusing the vector for repeated normalized text"""
+        key = text.strip().lower()
+        with self.embedding_cache_lock:
+            embedding = self.embedding_cache.get(key)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(key)
+            with self.embedding_cache_lock:
+                self.embedding_cache[key] = embedding
+        return embedding
+
+    def _cached_question_vector(self, question: str) -> Optional[np.ndarray]:
+        """Unit-length question embedding if already cached; never embeds on the caller's thread"""
+        with self.embedding_cache_lock:
+            embedding = self.embedding_cache.get(question.strip().lower())
+        if embedding is None:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _search_documents(
+        self, question: str, k: int, query_embedding: Optional[List[float]] = None
+    ) -> List[Dict[str, Any]]:
+        """Embed (cached) unless prefetched, and search in one executor hop"""
+        if query_embedding is None:
+            query_embedding = self._embed_cached(question)
+        return self.vector_store.similarity_search(question, k=k, query_embedding=query_embedding)
+
+    def _prefetch_embedding(self, question: str) -> asyncio.Future:
+        """Start embedding the question on the executor while classification runs"""
+        return asyncio.get_running_loop().run_in_executor(self.executor, self._embed_cached, question)
+
+    @staticmethod
+    def _record_step(node: str, status: str, start_ns: int, **data) -> Dict[str, Any]:
+        """Build a step entry; timestamp is wall-clock ms for the UI, duration from perf_counter_ns"""
+        data["processing_time_ms"] = (time.perf_counter_ns() - start_ns) // 1_000_000
+        return {
+            "node": node,
+            "status": status,
+            "timestamp": time.time() * 1000,
+            "data": data
+        }
+
+    @staticmethod
+    def _recent_exchanges(history: deque):
+        """Iterate the newest RECENT_EXCHANGES exchanges without copying the deque"""
+        return islice(history, max(0, len(history) - RECENT_EXCHANGES), None)
+
+    def _remember_exchange(self, conversation_id: str, exchange: Dict[str, Any]):
+        """Append an exchange and rebuild the conversation's classifier context once"""
+        memory = self.conversation_memory.get(conversation_id)
+        if memory is None:
+            memory = {
+                "history": deque(maxlen=MEMORY_MAX_EXCHANGES),
+                "recent_lower": "",
+                "recent_context": ""
+            }
+        
+        history = memory["history"]
+        
+        # Re-asking a recent question (reworded or not) replaces that exchange, latest wins.
+        # Short follow-ups ("yes", "more") only make sense next to what they answer, so keep them all
+        if len(exchange["question"].split()) > 3:
+            vector = self._cached_question_vector(exchange["question"])
+            if vector is not None:
+                exchange["embedding"] = vector
+                start = max(0, len(history) - RECENT_EXCHANGES)
+                for index in range(len(history) - 1, start - 1, -1):
+                    previous = history[index].get("embedding")
+                    if previous is not None and float(np.dot(vector, previous)) > MEMORY_DEDUPE_THRESHOLD:
+                        del history[index]
+                        break
+        
+        # The deque drops the oldest exchange itself
+        history.append(exchange)
+        
+        # Re-inserting restarts the conversation's TTL
+        self.conversation_memory[conversation_id] = memory
+        
+        recent_topics = []
+        context_parts = ["Recent conversation context:"]
+        for recent in self._recent_exchanges(history):
+            if 'question' in recent:
+                recent_topics.append(recent['question'].lower())
+            if 'answer' in recent:
+                recent_topics.append(recent['answer'].lower()[:100])
+            if 'question' in recent and 'answer' in recent:
+                context_parts.append(f"User asked: {recent['question']}")
+                # Keep more context, especially for questions and options
+                context_parts.append(f"You responded: {recent['answer'][:500]}...")
+        memory["recent_lower"] = " ".join(recent_topics)
+        memory["recent_context"] = "\n".join(context_parts)
+
     def _build_graph(self) -> StateGraph:
         """Build optimized graph"""
         graph = StateGraph(AgentState)
@@ -98,7 +362,6 @@ class FastInsightFlowAgent:
         # Add nodes
         graph.add_node("classify_query", self.classify_query)
         graph.add_node("retrieve_documents", self.retrieve_documents)
-        graph.add_node("analyze_context", self.analyze_context)
         graph.add_node("use_tools", self.use_tools)
         graph.add_node("generate_response", self.generate_response)
         
@@ -113,8 +376,7 @@ class FastInsightFlowAgent:
             }
         )
         
-        graph.add_edge("retrieve_documents", "analyze_context")
-        graph.add_edge("analyze_context", "generate_response")
+        graph.add_edge("retrieve_documents", "generate_response")
         graph.add_edge("use_tools", "generate_response")
         graph.add_edge("generate_response", END)
         
@@ -125,38 +387,24 @@ class FastInsightFlowAgent:
 
     async def classify_query(self, state: AgentState) -> AgentState:
         """Fast query classification with memory context"""
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
         question = state["question"]
         conversation_id = state["conversation_id"]
         
-        # Get conversation history
-        history = self.conversation_memory.get(conversation_id, [])
-        context = ""
-        if history:
-            recent_topics = []
-            for exchange in history[-3:]:  # Last 3 exchanges
-                if 'question' in exchange:
-                    recent_topics.append(exchange['question'].lower())
-                if 'answer' in exchange:
-                    recent_topics.append(exchange['answer'].lower()[:100])
-            context = " ".join(recent_topics)
+        # Get conversation history and its precomputed classifier context
+        memory = self.conversation_memory.get(conversation_id)
+        history = memory["history"] if memory else deque()
+        context = memory["recent_lower"] if memory else ""
+        recent_context = memory["recent_context"] if memory else ""
         
         # Enhanced classification considering context
         question_lower = question.lower()
         combined_text = f"{question_lower} {context}"
         
         # Rule-based classification with context awareness
-        if any(keyword in combined_text for keyword in [
-            "tax", "deduction", "business expense", "regulation", "legal", 
-            "rule", "requirement", "compliance", "GST", "HST", "freelancer",
-            "rate", "bracket", "income tax"  # Added tax-related terms
-        ]):
+        if RETRIEVAL_KEYWORDS.search(combined_text):
             query_type = "retrieval"
-        elif any(keyword in combined_text for keyword in [
-            "calculate", "compute", "weather", "price", 
-            "current", "recent", "news", "+", "%", "percent",
-            "date", "time", "today", "now", "what day", "what time"
-        ]):
+        elif TOOL_KEYWORDS.search(combined_text):
             query_type = "tool_use"
         else:
             # Check if question is contextual (short questions that need previous context)
@@ -165,9 +413,7 @@ class FastInsightFlowAgent:
                 last_topic = history[-1] if history else {}
                 if 'question' in last_topic:
                     last_q = last_topic['question'].lower()
-                    if any(keyword in last_q for keyword in [
-                        "tax", "deduction", "business", "legal", "rule"
-                    ]):
+                    if not FOLLOW_UP_RETRIEVAL_TOKENS.isdisjoint(WORD_PATTERN.findall(last_q)):
                         query_type = "retrieval"
                     else:
                         query_type = "direct"
@@ -176,22 +422,18 @@ class FastInsightFlowAgent:
             else:
                 query_type = "direct"
         
-        step = {
-            "node": "QueryClassifier",
-            "status": "completed",
-            "timestamp": time.time() * 1000,
-            "data": {
-                "query_type": query_type,
-                "classification_method": "rule_based_fast",
-                "memory_context_used": bool(context),
-                "processing_time_ms": int((time.time() - start_time) * 1000)
-            }
-        }
+        step = self._record_step(
+            "QueryClassifier", "completed", start_ns,
+            query_type=query_type,
+            classification_method="rule_based_fast",
+            memory_context_used=bool(context)
+        )
         
         state["steps"].append(step)
         state["query_type"] = query_type
         state["messages"] = [HumanMessage(content=question)]
         state["conversation_history"] = history
+        state["recent_context"] = recent_context
         
         return state
 
@@ -201,28 +443,27 @@ class FastInsightFlowAgent:
 
     async def retrieve_documents(self, state: AgentState) -> AgentState:
         """Fast document retrieval"""
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
         question = state["question"]
         
         try:
+            # The embedding was started before classification; usually it is done by now
+            prefetch = state.get("embedding_prefetch")
+            query_embedding = await prefetch if prefetch is not None else None
+            
             # Run retrieval in thread pool
-            loop = asyncio.get_event_loop()
+            loop = asyncio.get_running_loop()
             docs = await loop.run_in_executor(
                 self.executor,
-                functools.partial(self.vector_store.similarity_search, question, k=3)  # Reduced for speed
+                functools.partial(self._search_documents, question, 3, query_embedding)  # Reduced for speed
             )
             
-            step = {
-                "node": "DocumentRetriever",
-                "status": "completed",
-                "timestamp": time.time() * 1000,
-                "data": {
-                    "documents_found": len(docs),
-                    "avg_similarity_score": sum(doc.get("score", 0) for doc in docs) / len(docs) if docs else 0,
-                    "sources": [doc.get("metadata", {}).get("source", "unknown") for doc in docs],
-                    "processing_time_ms": int((time.time() - start_time) * 1000)
-                }
-            }
+            step = self._record_step(
+                "DocumentRetriever", "completed", start_ns,
+                documents_found=len(docs),
+                avg_similarity_score=sum(doc.get("score", 0) for doc in docs) / len(docs) if docs else 0,
+                sources=[doc.get("metadata", {}).get("source", "unknown") for doc in docs]
+            )
             
             state["steps"].append(step)
             state["retrieved_docs"] = docs
@@ -230,181 +471,82 @@ class FastInsightFlowAgent:
         except Exception as e:
             logger.error(f"Error in document retrieval: {e}")
             
-            step = {
-                "node": "DocumentRetriever",
-                "status": "error",
-                "timestamp": time.time() * 1000,
-                "data": {
-                    "error": str(e),
-                    "documents_found": 0,
-                    "processing_time_ms": int((time.time() - start_time) * 1000)
-                }
-            }
+            step = self._record_step(
+                "DocumentRetriever", "error", start_ns,
+                error=str(e),
+                documents_found=0
+            )
             
             state["steps"].append(step)
             state["retrieved_docs"] = []
         
         return state
 
-    async def analyze_context(self, state: AgentState) -> AgentState:
-        """Fast context analysis"""
-        start_time = time.time()
-        question = state["question"]
-        docs = state["retrieved_docs"]
-        
-        if not docs:
-            state["analysis"] = "No relevant documents found."
-            step = {
-                "node": "ContextAnalyzer",
-                "status": "completed",
-                "timestamp": time.time() * 1000,
-                "data": {
-                    "analysis_type": "no_documents",
-                    "processing_time_ms": int((time.time() - start_time) * 1000)
-                }
-            }
-            state["steps"].append(step)
-            return state
-        
-        # Quick analysis - just extract key info
-        key_info = []
-        for doc in docs[:2]:  # Only top 2 for speed
-            content = doc.get('content', '')[:300]  # Truncate
-            key_info.append(content)
-        
-        analysis = f"Found {len(docs)} relevant documents with key information about: {question}"
-        
-        step = {
-            "node": "ContextAnalyzer",
-            "status": "completed",
-            "timestamp": time.time() * 1000,
-            "data": {
-                "analysis_type": "fast_analysis",
-                "documents_analyzed": len(docs),
-                "analysis_length": len(analysis),
-                "processing_time_ms": int((time.time() - start_time) * 1000)
-            }
-        }
-        
-        state["steps"].append(step)
-        state["analysis"] = analysis
-        
-        return state
+    @staticmethod
+    def _select_tool(question_lower: str) -> str:
+        """Pick the tool for a question: datetime, web_search or calculator"""
+        if DATETIME_KEYWORDS.search(question_lower) or \
+                ("what" in question_lower and "time" in question_lower):
+            return "datetime"
+        if SEARCH_KEYWORDS.search(question_lower) and not MATH_KEYWORDS.search(question_lower):
+            return "web_search"
+        return "calculator"
 
     async def use_tools(self, state: AgentState) -> AgentState:
         """Fast tool usage"""
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
         question = state["question"]
         
         try:
-            # Smart tool selection based on question content
+            # Smart tool selection based on question content, decided once
             question_lower = question.lower()
+            tool_name = self._select_tool(question_lower)
             
-            if any(keyword in question_lower for keyword in ["date", "today", "now", "what day"]) or \
-               ("what" in question_lower and "time" in question_lower):
-                # Date/time query
-                loop = asyncio.get_event_loop()
+            if tool_name == "datetime":
+                # Date/time query; a clock read is cheaper than the hop to a worker thread
                 if "time" in question_lower:
-                    tool_result = await loop.run_in_executor(
-                        self.executor,
-                        functools.partial(self.tools.execute_tool, "datetime", "get_current_datetime")
-                    )
-                else:
-                    tool_result = await loop.run_in_executor(
-                        self.executor,
-                        functools.partial(self.tools.execute_tool, "datetime", "get_today_date")
-                    )
-            elif any(op in question_lower for op in ["+", "-", "*", "/", "calculate", "compute"]):
-                # Math calculation
-                import re
-                numbers = re.findall(r'\d+(?:\.\d+)?', question)
-                if len(numbers) >= 2:
-                    if "%" in question or "percent" in question:
-                        # Percentage calculation
-                        result = float(numbers[0]) * float(numbers[1]) / 100
-                        tool_result = {"result": result, "calculation": f"{numbers[0]}% of {numbers[1]} = {result}"}
-                    elif "+" in question:
-                        result = sum(float(n) for n in numbers)
-                        tool_result = {"result": result, "calculation": f"Sum = {result}"}
-                    else:
-                        result = float(numbers[0]) * float(numbers[1])
-                        tool_result = {"result": result, "calculation": f"{numbers[0]} × {numbers[1]} = {result}"}
+                    tool_result = self.tools.execute_tool("datetime", "get_current_datetime")
                 else:
-                    tool_result = {"error": "Could not extract numbers for calculation"}
+                    tool_result = self.tools.execute_tool("datetime", "get_today_date")
+            elif tool_name == "web_search":
+                tool_result = await self.tools.aexecute_tool("web_search", "search", query=question)
+            elif MATH_KEYWORDS.search(question_lower):
+                # Math calculation; the calculator tool only sees what the parser can't handle
+                tool_result = _evaluate_arithmetic(question)
+                if tool_result is None:
+                    tool_result = self.tools.execute_tool("calculator", "calculate", expression=question)
             else:
-                # Use appropriate tool
-                loop = asyncio.get_event_loop()
-                if any(keyword in question_lower for keyword in ["weather", "news", "current events"]):
-                    tool_result = await loop.run_in_executor(
-                        self.executor,
-                        functools.partial(self.tools.execute_tool, "web_search", "search", query=question)
-                    )
-                else:
-                    tool_result = await loop.run_in_executor(
-                        self.executor,
-                        functools.partial(self.tools.execute_tool, "calculator", "calculate", expression=question)
-                    )
+                tool_result = self.tools.execute_tool("calculator", "calculate", expression=question)
             
-            # Determine which tool was actually used
-            if any(keyword in question_lower for keyword in ["date", "today", "now", "what day"]) or \
-               ("what" in question_lower and "time" in question_lower):
-                tool_name = "datetime"
-            elif any(keyword in question_lower for keyword in ["weather", "news", "current events"]):
-                tool_name = "web_search"
-            else:
-                tool_name = "calculator"
-                
-            step = {
-                "node": "ToolUser",
-                "status": "completed",
-                "timestamp": time.time() * 1000,
-                "data": {
-                    "tool_selected": tool_name,
-                    "tool_result": str(tool_result)[:200],
-                    "processing_time_ms": int((time.time() - start_time) * 1000)
-                }
-            }
+            step = self._record_step(
+                "ToolUser", "completed", start_ns,
+                tool_selected=tool_name,
+                tool_result=str(tool_result)[:200]
+            )
             
             state["tool_result"] = tool_result
             
         except Exception as e:
             logger.error(f"Error using tools: {e}")
             
-            step = {
-                "node": "ToolUser",
-                "status": "error",
-                "timestamp": time.time() * 1000,
-                "data": {
-                    "error": str(e),
-                    "processing_time_ms": int((time.time() - start_time) * 1000)
-                }
-            }
+            step = self._record_step("ToolUser", "error", start_ns, error=str(e))
             
             state["tool_result"] = None
         
         state["steps"].append(step)
         return state
 
-    async def generate_response(self, state: AgentState) -> AgentState:
-        """Fast response generation with memory"""
-        start_time = time.time()
+    def _build_response_prompt(self, state: AgentState) -> str:
+        """Pick and fill the response prompt for the current state"""
         question = state["question"]
         query_type = state.get("query_type", "direct")
-        conversation_id = state["conversation_id"]
-        history = state.get("conversation_history", [])
+        history = state.get("conversation_history", deque())
         
-        # Build comprehensive context with conversation history
+        # Build comprehensive context; the conversation part was assembled when memory was written
         context_parts = []
-        
-        # Add conversation history with full context
-        if history:
-            context_parts.append("Recent conversation context:")
-            for exchange in history[-3:]:  # Last 3 exchanges for better context
-                if 'question' in exchange and 'answer' in exchange:
-                    context_parts.append(f"User asked: {exchange['question']}")
-                    # Keep more context, especially for questions and options
-                    answer_text = exchange['answer'][:500]  # Increased from 100 to 500
-                    context_parts.append(f"You responded: {answer_text}...")
+        recent_context = state.get("recent_context", "")
+        if recent_context:
+            context_parts.append(recent_context)
         
         # Add current query context naturally
         if query_type == "retrieval":
@@ -425,103 +567,64 @@ class FastInsightFlowAgent:
         # Enhanced natural conversation prompt
         if history and len(question.split()) <= 3:
             # Short question with history - likely contextual
-            last_response = history[-1].get('answer', '') if history else ''
-            response_prompt = f"""
-            Continue this natural conversation. The user just said: "{question}"
+            response_prompt = CONTEXTUAL_RESPONSE_PROMPT.format(question=question, context=context)
+        elif "tool_result" in state and query_type == "tool_use":
+            tool_result = state.get('tool_result', {})
             
-            {context}
-            
-            Important: If the user's response refers to options or choices you previously offered (like "general", "specific", "yes", "no"), understand which option they're choosing and respond accordingly. Don't ask the same clarifying questions again - they already answered.
-            
-            Respond naturally and directly based on their choice.
-            """
-        else:
-            # Regular question
-            if "tool_result" in state and state.get("query_type") == "tool_use":
-                tool_result = state.get('tool_result', {})
-                
-                # Extract date information if available
-                if isinstance(tool_result, dict) and 'result' in tool_result:
-                    if 'today' in str(tool_result):
-                        try:
-                            date_info = tool_result['result']['today']['formatted']
-                            response_prompt = f"""
-                            The user asked: "{question}"
-                            
-                            The current date tool returned: {date_info}
-                            
-                            CRITICAL: You MUST use this exact date information. Do NOT use any other date. 
-                            Answer with the date from the tool result only.
-                            """
-                        except:
-                            response_prompt = f"""
-                            Answer this question using the tool result: "{question}"
-                            Tool result: {tool_result}
-                            IMPORTANT: Use only the information from the tool result.
-                            """
-                    else:
-                        response_prompt = f"""
-                        Answer this question using the tool result: "{question}"
-                        Tool result: {tool_result}
-                        IMPORTANT: Use only the information from the tool result.
-                        """
+            # Extract date information if available
+            if isinstance(tool_result, dict) and 'result' in tool_result:
+                try:
+                    date_info = tool_result['result']['today']['formatted'] if 'today' in str(tool_result) else None
+                except (KeyError, TypeError):
+                    date_info = None
+                if date_info:
+                    response_prompt = DATE_TOOL_RESPONSE_PROMPT.format(question=question, date_info=date_info)
                 else:
-                    response_prompt = f"""
-                    Answer this question using the tool result provided: "{question}"
-                    
-                    {context if context != "No previous context" else ""}
-                    
-                    IMPORTANT: Use the exact information from the tool result. Do not make up or guess information.
-                    """
+                    response_prompt = TOOL_RESULT_RESPONSE_PROMPT.format(question=question, tool_result=tool_result)
             else:
-                response_prompt = f"""
-                Answer this question helpfully and naturally: "{question}"
-                
-                {context if context != "No previous context" else ""}
-                """
+                response_prompt = TOOL_CONTEXT_RESPONSE_PROMPT.format(
+                    question=question, context=context if context_parts else ""
+                )
+        else:
+            response_prompt = RESPONSE_PROMPT.format(
+                question=question, context=context if context_parts else ""
+            )
+        
+        return response_prompt
+
+    async def generate_response(self, state: AgentState) -> AgentState:
+        """Fast response generation with memory"""
+        start_ns = time.perf_counter_ns()
+        question = state["question"]
+        query_type = state.get("query_type", "direct")
+        conversation_id = state["conversation_id"]
+        response_prompt = self._build_response_prompt(state)
         
         try:
             response = await self.llm.ainvoke([HumanMessage(content=response_prompt)])
             final_response = response.content
             
             # Save to memory with full context
-            self.conversation_memory.setdefault(conversation_id, []).append({
+            self._remember_exchange(conversation_id, {
                 "question": question,
-                "answer": final_response[:800],  # Much more content for context continuity
+                "answer": final_response[:MEMORY_ANSWER_CHARS],  # Much more content for context continuity
                 "query_type": query_type,
                 "timestamp": time.time()
             })
             
-            # Keep only last 10 exchanges
-            if len(self.conversation_memory[conversation_id]) > 10:
-                self.conversation_memory[conversation_id] = self.conversation_memory[conversation_id][-10:]
-            
-            step = {
-                "node": "ResponseGenerator",
-                "status": "completed",
-                "timestamp": time.time() * 1000,
-                "data": {
-                    "response_length": len(final_response),
-                    "word_count": len(final_response.split()),
-                    "sources_referenced": len(state.get('retrieved_docs', [])),
-                    "memory_updated": True,
-                    "processing_time_ms": int((time.time() - start_time) * 1000)
-                }
-            }
+            step = self._record_step(
+                "ResponseGenerator", "completed", start_ns,
+                response_length=len(final_response),
+                word_count=len(final_response.split()),
+                sources_referenced=len(state.get('retrieved_docs', [])),
+                memory_updated=True
+            )
             
         except Exception as e:
             logger.error(f"Error generating response: {e}")
             final_response = f"I apologize, but I encountered an error: {str(e)}"
             
-            step = {
-                "node": "ResponseGenerator",
-                "status": "error",
-                "timestamp": time.time() * 1000,
-                "data": {
-                    "error": str(e),
-                    "processing_time_ms": int((time.time() - start_time) * 1000)
-                }
-            }
+            step = self._record_step("ResponseGenerator", "error", start_ns, error=str(e))
         
         state["steps"].append(step)
         state["response"] = final_response
@@ -537,24 +640,21 @@ class FastInsightFlowAgent:
             messages=[],
             question=question,
             retrieved_docs=[],
-            analysis="",
             response="",
             steps=[],
             conversation_id=conversation_id,
             query_type="",
-            conversation_history=[]
+            conversation_history=deque(),
+            recent_context="",
+            # Warms the embedding cache even when the query turns out not to need retrieval
+            embedding_prefetch=self._prefetch_embedding(question)
         )
         
         try:
-            # Run the graph
+            # Run the graph, timing the whole traversal rather than step-to-step gaps
+            start_ns = time.perf_counter_ns()
             result = await self.graph.ainvoke(initial_state)
-            
-            # Calculate total processing time
-            total_time = 0
-            if result["steps"]:
-                start_time = result["steps"][0]["timestamp"]
-                end_time = result["steps"][-1]["timestamp"]
-                total_time = int(end_time - start_time)
+            total_time = (time.perf_counter_ns() - start_ns) // 1_000_000
             
             return {
                 "answer": result["response"],
@@ -596,6 +696,101 @@ class FastInsightFlowAgent:
                 }
             }
 
+    async def process_query_stream(self, question: str, conversation_id: str = "default") -> AsyncGenerator[Dict[str, Any], None]:
+        """Process a user query, streaming steps and response tokens as they are produced"""
+        
+        start_ns = time.perf_counter_ns()
+        
+        # Initialize state
+        state = AgentState(
+            messages=[],
+            question=question,
+            retrieved_docs=[],
+            response="",
+            steps=[],
+            conversation_id=conversation_id,
+            query_type="",
+            conversation_history=deque(),
+            recent_context="",
+            # Warms the embedding cache even when the query turns out not to need retrieval
+            embedding_prefetch=self._prefetch_embedding(question)
+        )
+        
+        try:
+            # Same node order as the graph, yielding each step as it completes
+            state = await self.classify_query(state)
+            yield {"type": "step", "step": state["steps"][-1], "progress": 20}
+            
+            query_type = state["query_type"]
+            if query_type == "retrieval":
+                state = await self.retrieve_documents(state)
+                yield {"type": "step", "step": state["steps"][-1], "progress": 60}
+            elif query_type == "tool_use":
+                state = await self.use_tools(state)
+                yield {"type": "step", "step": state["steps"][-1], "progress": 60}
+            
+            yield {
+                "type": "step",
+                "step": {
+                    "node": "ResponseGenerator",
+                    "status": "in_progress",
+                    "timestamp": time.time() * 1000,
+                    "data": {"streaming": True}
+                },
+                "progress": 80
+            }
+            
+            # Only the head of the answer goes to memory, so stop buffering once it is full
+            memory_parts = []
+            memory_length = 0
+            response_length = 0
+            prompt = self._build_response_prompt(state)
+            async for chunk in self.llm.astream([HumanMessage(content=prompt)]):
+                token = chunk.content
+                if not token:
+                    continue
+                response_length += len(token)
+                if memory_length < MEMORY_ANSWER_CHARS:
+                    memory_parts.append(token)
+                    memory_length += len(token)
+                yield {
+                    "type": "token",
+                    "content": token,
+                    "progress": min(95, 80 + (response_length / 10))
+                }
+            
+            self._remember_exchange(conversation_id, {
+                "question": question,
+                "answer": "".join(memory_parts)[:MEMORY_ANSWER_CHARS],
+                "query_type": query_type,
+                "timestamp": time.time()
+            })
+            
+            # Whole run on the monotonic clock, classification and prefetch included
+            total_time = (time.perf_counter_ns() - start_ns) // 1_000_000
+            
+            yield {
+                "type": "complete",
+                "metadata": {
+                    "query_type": query_type,
+                    "total_processing_time_ms": total_time,
+                    "documents_used": len(state.get("retrieved_docs", [])),
+                    "steps_executed": len(state["steps"]) + 1,
+                    "model_used": "gemini-2.0-flash-exp",
+                    "memory_enabled": True,
+                    "streaming_enabled": True
+                },
+                "progress": 100
+            }
+            
+        except Exception as e:
+            logger.error(f"Error processing streaming query: {e}")
+            yield {
+                "type": "error",
+                "error": str(e),
+                "progress": 100
+            }
+
 # Global agent instance
 _agent_instance = None
 
@@ -1,4 +1,4 @@
-from typing import TypedDict, List, Dict, Any, Optional
+from typing import TypedDict, List, Dict, Any, Optional, AsyncGenerator
 from langchain.schema import BaseMessage, HumanMessage, AIMessage
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_community.embeddings import SentenceTransformerEmbeddings
@@ -10,8 +10,14 @@ import os
 from dotenv import load_dotenv
 import logging
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
 import functools
+import orjson
+from collections import deque
+from cachetools import LRUCache, TTLCache
+
+from graphs.common import (
+    QUERY_TYPES, RETRIEVAL_KEYWORDS, TOOL_KEYWORDS, ERROR_FALLBACK_KEYWORDS, create_retrieval_executor
+)
 
 # Load environment variables
 load_dotenv()
@@ -19,6 +25,126 @@ load_dotenv()
 # Setup logging
 logger = logging.getLogger(__name__)
 
+# Conversations held in the local memory cache, how long an idle one stays, and entries kept per conversation
+CONVERSATION_CACHE_SIZE = 1024
+CONVERSATION_MEMORY_TTL = int(os.getenv("CONVERSATION_MEMORY_TTL", "3600"))
+CONVERSATION_CACHE_ENTRIES = 32
+
+# Classifications remembered per (question, memory prefix); temperature is low so they repeat
+CLASSIFICATION_CACHE_SIZE = 4096
+
+# Query categories shared by the fused and classification-only prompts
+QUERY_CATEGORIES = """
+Categories:
+1. "retrieval" - Questions about specific topics that need document search:
+   - Tax rules, regulations, compliance
+   - Business expenses, deductions
+   - Legal requirements, procedures
+   - Specific industry knowledge
+   - Technical documentation
+
+2. "tool_use" - Questions needing calculations or current data:
+   - Mathematical calculations
+   - Current events, news, recent information
+   - Weather, stock prices, live data
+   - Web searches for current information
+
+3. "direct" - Questions answerable with general knowledge:
+   - General concepts, definitions
+   - Common knowledge topics
+   - Simple explanations
+   - Greetings, casual conversation
+"""
+
+# Classification, document analysis and the answer in one round trip; filled with str.format
+FUSED_PROMPT = """
+Classify the user's question, analyze any relevant documents, and answer it.
+""" + QUERY_CATEGORIES + """
+Question: "{question}"
+
+{memory}
+
+Documents retrieved for the question (use them only if the question is "retrieval"):
+{documents}
+
+Consider the context when classifying. If the user is following up on a previous topic,
+classify accordingly.
+
+For "retrieval", "analysis" briefly states the key information from the documents that answers
+the question and a confidence level (1-10). Otherwise "analysis" is an empty string.
+
+For "retrieval" and "direct", "response" is a clear, well-structured answer: accurate and helpful,
+referencing previous conversation if relevant, citing sources when available, conversational but
+professional, and acknowledging when information is limited.
+For "tool_use", "response" is an empty string; the answer is written after the tool runs.
+
+Respond with ONLY a JSON object:
+{{"query_type": "retrieval" | "tool_use" | "direct", "analysis": "...", "response": "..."}}
+"""
+
+# Classification alone, for streaming, where the answer is generated token by token afterwards
+CLASSIFICATION_PROMPT = """
+Classify the user's question.
+""" + QUERY_CATEGORIES + """
+Question: "{question}"
+
+{memory}
+
+Consider the context when classifying. If the user is following up on a previous topic,
+classify accordingly.
+
+Respond with ONLY a JSON object:
+{{"query_type": "retrieval" | "tool_use" | "direct"}}
+"""
+
+# Prompts for the step-by-step fallback path and streaming
+ANALYSIS_PROMPT = """
+Based on the documents and conversation history, analyze how they relate to the user's question.
+Be concise but thorough.
+
+Question: "{question}"
+
+{memory}
+
+Documents:
+{context}
+
+Provide a brief analysis focusing on:
+1. Key information that answers the question
+2. Confidence level (1-10)
+"""
+
+TOOL_SELECTION_PROMPT = """
+Based on this question, which tool should be used?
+
+Question: "{question}"
+
+Available tools:
+- web_search: For current information, news, or general web queries
+- calculator: For mathematical calculations
+
+Respond with: tool_name: specific_query
+"""
+
+RESPONSE_PROMPT = """
+Provide a comprehensive answer to the user's question.
+
+Question: "{question}"
+
+{memory}
+
+Current Context: {context}
+
+Guidelines:
+1. Be accurate and helpful
+2. Reference previous conversation if relevant
+3. Cite sources when available
+4. Be conversational but professional
+5. If information is limited, acknowledge it
+
+Provide a clear, well-structured response.
+"""
+
 class AgentState(TypedDict):
     messages: List[BaseMessage]
     question: str
@@ -29,6 +155,8 @@ class AgentState(TypedDict):
     conversation_id: str
     query_type: str
     memory_context: Optional[str]
+    prefetched_docs: Optional[List[Dict[str, Any]]]
+    tool_result: Any
 
 class OptimizedInsightFlowAgent:
     _instance = None
@@ -59,6 +187,9 @@ class OptimizedInsightFlowAgent:
             timeout=30
         )
         
+        # Same model in JSON mode for the fused classify/analyze/answer call
+        self.json_llm = self.llm.bind(generation_config={"response_mime_type": "application/json"})
+        
         # Initialize embeddings (cached)
         self.embeddings = SentenceTransformerEmbeddings(
             model_name="all-MiniLM-L6-v2",
@@ -85,11 +216,17 @@ class OptimizedInsightFlowAgent:
         # Build graph
         self.graph = self._build_graph()
         
-        # Thread pool for parallel processing
-        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.executor = create_retrieval_executor()
         
-        # Conversation cache
-        self.conversation_cache = {}
+        # (normalized question, memory prefix) -> query_type from earlier fused or classification calls
+        self.classification_cache = LRUCache(maxsize=CLASSIFICATION_CACHE_SIZE)
+        
+        # Memory saves still running after a stream finished; held so they aren't garbage collected
+        self._background_tasks = set()
+        
+        # Conversation cache: conversation_id -> deque of memory entries, bounded and expiring.
+        # Only touched from the event loop with no await between read and write, so no lock
+        self.conversation_cache = TTLCache(maxsize=CONVERSATION_CACHE_SIZE, ttl=CONVERSATION_MEMORY_TTL)
         
         self._initialized = True
         logger.info("OptimizedInsightFlowAgent initialized successfully")
@@ -113,8 +250,8 @@ class OptimizedInsightFlowAgent:
         graph = StateGraph(AgentState)
         
         # Add nodes
-        graph.add_node("load_memory", self.load_memory)
-        graph.add_node("classify_query", self.classify_query)
+        graph.add_node("parallel_prefetch", self.parallel_prefetch)
+        graph.add_node("fused_reasoner", self.fused_reasoner)
         graph.add_node("retrieve_documents", self.retrieve_documents)
         graph.add_node("analyze_context", self.analyze_context)
         graph.add_node("use_tools", self.use_tools)
@@ -122,12 +259,15 @@ class OptimizedInsightFlowAgent:
         graph.add_node("save_memory", self.save_memory)
         
         # Add edges with memory flow
-        graph.add_edge("load_memory", "classify_query")
+        graph.add_edge("parallel_prefetch", "fused_reasoner")
         
+        # The fused call normally answers retrieval/direct itself; the per-step nodes
+        # remain for tool results and for when its reply can't be used
         graph.add_conditional_edges(
-            "classify_query",
+            "fused_reasoner",
             self._route_query,
             {
+                "answered": "save_memory",
                 "retrieval": "retrieve_documents",
                 "tool_use": "use_tools",
                 "direct": "generate_response"
@@ -141,38 +281,61 @@ class OptimizedInsightFlowAgent:
         graph.add_edge("save_memory", END)
         
         # Set entry point
-        graph.set_entry_point("load_memory")
+        graph.set_entry_point("parallel_prefetch")
         
         return graph.compile()
 
-    async def load_memory(self, state: AgentState) -> AgentState:
-        """Load conversation memory and context"""
+    async def _search_memory(self, conversation_id: str) -> str:
+        """Conversation memory from the cache, else from the memory store"""
+        # Check cache first
+        entries = self.conversation_cache.get(conversation_id)
+        if entries is not None:
+            logger.info(f"Loaded memory from cache for {conversation_id}")
+            return "\n".join(entries)
+        
+        # Search memory store for relevant context
+        memory_search_tool = self.memory_tools[1]  # search tool
+        
+        # Search for relevant memories
+        memory_result = await memory_search_tool.ainvoke({
+            "query": f"conversation {conversation_id} context history",
+            "k": 5
+        })
+        
+        memory_context = ""
+        if memory_result and hasattr(memory_result, 'content'):
+            memory_context = memory_result.content
+        elif isinstance(memory_result, str):
+            memory_context = memory_result
+        
+        # Cache the result
+        entries = deque(maxlen=CONVERSATION_CACHE_ENTRIES)
+        if memory_context:
+            entries.append(memory_context)
+        self.conversation_cache[conversation_id] = entries
+        return memory_context
+
+    async def parallel_prefetch(self, state: AgentState) -> AgentState:
+        """Load conversation memory while speculatively retrieving documents for the raw question"""
         start_time = time.time()
         conversation_id = state["conversation_id"]
         
+        # Retrieval doesn't depend on memory or classification, so overlap the two;
+        # the docs are simply dropped if the query isn't classified as retrieval
+        loop = asyncio.get_running_loop()
+        memory_context, docs = await asyncio.gather(
+            self._search_memory(conversation_id),
+            loop.run_in_executor(
+                self.executor,
+                functools.partial(self.vector_store.similarity_search, state["question"], k=5)
+            ),
+            return_exceptions=True
+        )
+        state["prefetched_docs"] = None if isinstance(docs, BaseException) else docs
+        
         try:
-            # Check cache first
-            if conversation_id in self.conversation_cache:
-                memory_context = self.conversation_cache[conversation_id]
-                logger.info(f"Loaded memory from cache for {conversation_id}")
-            else:
-                # Search memory store for relevant context
-                memory_search_tool = self.memory_tools[1]  # search tool
-                
-                # Search for relevant memories
-                memory_result = await memory_search_tool.ainvoke({
-                    "query": f"conversation {conversation_id} context history",
-                    "k": 5
-                })
-                
-                memory_context = ""
-                if memory_result and hasattr(memory_result, 'content'):
-                    memory_context = memory_result.content
-                elif isinstance(memory_result, str):
-                    memory_context = memory_result
-                
-                # Cache the result
-                self.conversation_cache[conversation_id] = memory_context
+            if isinstance(memory_context, BaseException):
+                raise memory_context
             
             step = {
                 "node": "MemoryLoader",
@@ -206,104 +369,164 @@ class OptimizedInsightFlowAgent:
         
         return state
 
-    async def classify_query(self, state: AgentState) -> AgentState:
-        """Enhanced query classification with memory context"""
+    @staticmethod
+    def _classification_key(question: str, memory_context: Optional[str]) -> tuple:
+        """Classification cache key: normalized question plus the start of the memory context"""
+        return (question.strip().lower(), memory_context[:200] if memory_context else "")
+
+    async def _classify_query(self, question: str, memory_context: str) -> tuple:
+        """Classify with a classification-only LLM call; returns (query_type, method)"""
+        classification_key = self._classification_key(question, memory_context)
+        query_type = self.classification_cache.get(classification_key)
+        if query_type is not None:
+            return query_type, "cached"
+        
+        classification_prompt = CLASSIFICATION_PROMPT.format(
+            question=question,
+            memory=f"Previous conversation context: {memory_context[:500]}..." if memory_context else "No previous context available."
+        )
+        try:
+            response = await self.json_llm.ainvoke([HumanMessage(content=classification_prompt)])
+            result = orjson.loads(response.content.strip().removeprefix("```json").strip("`"))
+            query_type = result.get("query_type")
+        except Exception as e:
+            logger.error(f"Error classifying query: {e}")
+        
+        if query_type in QUERY_TYPES:
+            self.classification_cache[classification_key] = query_type
+            return query_type, "llm"
+        
+        if RETRIEVAL_KEYWORDS.search(question):
+            return "retrieval", "keyword_fallback"
+        if TOOL_KEYWORDS.search(question):
+            return "tool_use", "keyword_fallback"
+        return "direct", "keyword_fallback"
+
+    async def fused_reasoner(self, state: AgentState) -> AgentState:
+        """Classify, analyze prefetched documents and answer in a single LLM call"""
         start_time = time.time()
         question = state["question"]
         memory_context = state.get("memory_context", "")
+        docs = state.get("prefetched_docs") or []
         
-        # Enhanced classification prompt with memory
-        classification_prompt = f"""
-        Analyze this user question and classify it into one of these categories:
-        
-        1. "retrieval" - Questions about specific topics that need document search:
-           - Tax rules, regulations, compliance
-           - Business expenses, deductions
-           - Legal requirements, procedures
-           - Specific industry knowledge
-           - Technical documentation
-        
-        2. "tool_use" - Questions needing calculations or current data:
-           - Mathematical calculations
-           - Current events, news, recent information
-           - Weather, stock prices, live data
-           - Web searches for current information
-        
-        3. "direct" - Questions answerable with general knowledge:
-           - General concepts, definitions
-           - Common knowledge topics
-           - Simple explanations
-           - Greetings, casual conversation
-        
-        Question: "{question}"
+        analysis = ""
+        final_response = ""
+        classification_key = self._classification_key(question, memory_context)
+        query_type = self.classification_cache.get(classification_key)
         
-        {f"Previous conversation context: {memory_context[:500]}..." if memory_context else "No previous context available."}
-        
-        Consider the context when classifying. If the user is following up on a previous topic,
-        classify accordingly.
-        
-        Respond with ONLY the category name: retrieval, tool_use, or direct
-        """
-        
-        try:
-            # Use async LLM call
-            response = await self.llm.ainvoke([HumanMessage(content=classification_prompt)])
-            classification_text = response.content.strip().lower()
-            
-            # Enhanced classification parsing
-            if "retrieval" in classification_text:
-                query_type = "retrieval"
-            elif "tool_use" in classification_text:
-                query_type = "tool_use"
-            elif "direct" in classification_text:
-                query_type = "direct"
-            else:
-                # Smarter fallback with context
-                question_lower = question.lower()
-                if any(keyword in question_lower for keyword in [
-                    "tax", "deduction", "business expense", "regulation", "legal", 
-                    "rule", "requirement", "compliance", "GST", "HST", "freelancer"
-                ]):
-                    query_type = "retrieval"
-                elif any(keyword in question_lower for keyword in [
-                    "calculate", "compute", "what is", "weather", "price", 
-                    "current", "today", "recent", "news"
-                ]):
-                    query_type = "tool_use"
-                else:
-                    query_type = "direct"
+        # A known tool question needs nothing from the fused call: its answer waits for the tool.
+        # Known retrieval/direct questions still make the call, since it also writes the answer
+        if query_type == "tool_use":
+            classification_method = "cached"
+        else:
+            documents = "\n\n".join([
+                f"Document {i+1}: {doc.get('content', '')[:500]}..."  # Truncate for speed
+                for i, doc in enumerate(docs[:3])  # Use only top 3
+            ]) or "No documents found."
+            fused_prompt = FUSED_PROMPT.format(
+                question=question,
+                memory=f"Previous conversation context: {memory_context[:500]}..." if memory_context else "No previous context available.",
+                documents=documents
+            )
+            
+            try:
+                response = await self.json_llm.ainvoke([HumanMessage(content=fused_prompt)])
+                result = orjson.loads(response.content.strip().removeprefix("```json").strip("`"))
                 
-        except Exception as e:
-            logger.error(f"Error in query classification: {e}")
-            # Intelligent fallback
-            question_lower = question.lower()
-            if any(keyword in question_lower for keyword in [
-                "tax", "deduction", "business", "legal", "rule", "regulation"
-            ]):
-                query_type = "retrieval"
-            else:
-                query_type = "direct"
-        
-        step = {
+                query_type = result.get("query_type")
+                if query_type in QUERY_TYPES:
+                    classification_method = "fused_llm"
+                    analysis = result.get("analysis") or ""
+                    final_response = result.get("response") or ""
+                    self.classification_cache[classification_key] = query_type
+                else:
+                    # Smarter fallback with context
+                    classification_method = "keyword_fallback"
+                    if RETRIEVAL_KEYWORDS.search(question):
+                        query_type = "retrieval"
+                    elif TOOL_KEYWORDS.search(question):
+                        query_type = "tool_use"
+                    else:
+                        query_type = "direct"
+                    
+            except Exception as e:
+                logger.error(f"Error in fused reasoning: {e}")
+                # Intelligent fallback
+                classification_method = "fallback classification"
+                query_type = "retrieval" if ERROR_FALLBACK_KEYWORDS.search(question) else "direct"
+        
+        # A tool answer needs the tool's output, which only exists after use_tools
+        if query_type == "tool_use":
+            final_response = ""
+        
+        state["messages"] = [HumanMessage(content=question)]
+        state["query_type"] = query_type
+        state["steps"].append({
             "node": "QueryClassifier",
             "status": "completed",
             "timestamp": time.time() * 1000,
             "data": {
                 "query_type": query_type,
-                "classification_reasoning": classification_text if 'classification_text' in locals() else "fallback classification",
+                "classification_reasoning": classification_method,
                 "memory_context_used": bool(memory_context),
                 "processing_time_ms": int((time.time() - start_time) * 1000)
             }
-        }
+        })
         
-        state["steps"].append(step)
-        state["query_type"] = query_type
-        state["messages"] = [HumanMessage(content=question)]
+        if not final_response:
+            return state
+        
+        # Answered in this call; record the stages it covered so the trace reads as before
+        if query_type == "retrieval":
+            state["retrieved_docs"] = docs
+            state["analysis"] = analysis
+            state["steps"].append({
+                "node": "DocumentRetriever",
+                "status": "completed",
+                "timestamp": time.time() * 1000,
+                "data": {
+                    "documents_found": len(docs),
+                    "avg_similarity_score": sum(doc.get("score", 0) for doc in docs) / len(docs) if docs else 0,
+                    "sources": [doc.get("metadata", {}).get("source", "unknown") for doc in docs],
+                    "prefetched": True,
+                    "processing_time_ms": 0
+                }
+            })
+            state["steps"].append({
+                "node": "ContextAnalyzer",
+                "status": "completed",
+                "timestamp": time.time() * 1000,
+                "data": {
+                    "analysis_type": "fused_analysis",
+                    "documents_analyzed": min(len(docs), 3),
+                    "analysis_length": len(analysis),
+                    "memory_integrated": bool(memory_context),
+                    "processing_time_ms": 0
+                }
+            })
+        
+        state["steps"].append({
+            "node": "ResponseGenerator",
+            "status": "completed",
+            "timestamp": time.time() * 1000,
+            "data": {
+                "response_length": len(final_response),
+                "word_count": len(final_response.split()),
+                "sources_referenced": len(state.get('retrieved_docs', [])),
+                "memory_context_used": bool(memory_context),
+                "fused": True,
+                "processing_time_ms": int((time.time() - start_time) * 1000)
+            }
+        })
+        state["response"] = final_response
+        state["messages"].append(AIMessage(content=final_response))
         
         return state
 
     def _route_query(self, state: AgentState) -> str:
-        """Route based on query classification"""
+        """Route based on query classification, or straight to memory once answered"""
+        if state.get("response"):
+            return "answered"
         return state.get("query_type", "direct")
 
     async def retrieve_documents(self, state: AgentState) -> AgentState:
@@ -312,12 +535,14 @@ class OptimizedInsightFlowAgent:
         question = state["question"]
         
         try:
-            # Run retrieval in thread pool for non-blocking
-            loop = asyncio.get_event_loop()
-            docs = await loop.run_in_executor(
-                self.executor,
-                functools.partial(self.vector_store.similarity_search, question, k=5)
-            )
+            # Usually already fetched alongside memory; search again only if that failed
+            docs = state.get("prefetched_docs")
+            if docs is None:
+                loop = asyncio.get_running_loop()
+                docs = await loop.run_in_executor(
+                    self.executor,
+                    functools.partial(self.vector_store.similarity_search, question, k=5)
+                )
             
             step = {
                 "node": "DocumentRetriever",
@@ -380,21 +605,11 @@ class OptimizedInsightFlowAgent:
             for i, doc in enumerate(docs[:3])  # Use only top 3
         ])
         
-        analysis_prompt = f"""
-        Based on the documents and conversation history, analyze how they relate to the user's question.
-        Be concise but thorough.
-        
-        Question: "{question}"
-        
-        {f"Previous context: {memory_context[:300]}..." if memory_context else ""}
-        
-        Documents:
-        {context}
-        
-        Provide a brief analysis focusing on:
-        1. Key information that answers the question
-        2. Confidence level (1-10)
-        """
+        analysis_prompt = ANALYSIS_PROMPT.format(
+            question=question,
+            memory=f"Previous context: {memory_context[:300]}..." if memory_context else "",
+            context=context
+        )
         
         try:
             response = await self.llm.ainvoke([HumanMessage(content=analysis_prompt)])
@@ -437,38 +652,21 @@ class OptimizedInsightFlowAgent:
         start_time = time.time()
         question = state["question"]
         
-        tool_selection_prompt = f"""
-        Based on this question, which tool should be used?
-        
-        Question: "{question}"
-        
-        Available tools:
-        - web_search: For current information, news, or general web queries
-        - calculator: For mathematical calculations
-        
-        Respond with: tool_name: specific_query
-        """
+        tool_selection_prompt = TOOL_SELECTION_PROMPT.format(question=question)
         
         try:
             response = await self.llm.ainvoke([HumanMessage(content=tool_selection_prompt)])
             tool_instruction = response.content.strip()
             
-            # Run tool execution in thread pool
-            loop = asyncio.get_event_loop()
+            # Web search awaits its async HTTP client; the calculator is too cheap for a thread hop
             tool_result = None
             
             if "calculator:" in tool_instruction.lower():
                 expression = tool_instruction.split(":", 1)[1].strip()
-                tool_result = await loop.run_in_executor(
-                    self.executor,
-                    functools.partial(self.tools.execute_tool, "calculator", "calculate", expression=expression)
-                )
+                tool_result = self.tools.execute_tool("calculator", "calculate", expression=expression)
             elif "web_search:" in tool_instruction.lower():
                 query = tool_instruction.split(":", 1)[1].strip()
-                tool_result = await loop.run_in_executor(
-                    self.executor,
-                    functools.partial(self.tools.execute_tool, "web_search", "search", query=query)
-                )
+                tool_result = await self.tools.aexecute_tool("web_search", "search", query=query)
             
             step = {
                 "node": "ToolUser",
@@ -501,42 +699,41 @@ class OptimizedInsightFlowAgent:
         state["steps"].append(step)
         return state
 
-    async def generate_response(self, state: AgentState) -> AgentState:
-        """Enhanced response generation with memory context"""
-        start_time = time.time()
+    def _build_response_prompt(self, state: AgentState) -> str:
+        """Answer prompt for the current state, shared by the graph and the streaming path"""
         question = state["question"]
         query_type = state.get("query_type", "direct")
         memory_context = state.get("memory_context", "")
         
         # Build context based on query type
-        if query_type == "retrieval":
-            context = f"""
-            Analysis: {state.get('analysis', 'No analysis available')}
-            Retrieved Documents: {len(state.get('retrieved_docs', []))} documents found
-            """
+        if query_type == "retrieval" and not state.get("analysis"):
+            # Streaming skips the analysis call, so the answer reads the documents directly
+            documents = "\n\n".join([
+                f"Document {i+1}: {doc.get('content', '')[:500]}..."
+                for i, doc in enumerate(state.get('retrieved_docs', [])[:3])
+            ])
+            context = f"\nRetrieved Documents:\n{documents or 'No relevant documents found.'}"
+        elif query_type == "retrieval":
+            context = (
+                f"\nAnalysis: {state.get('analysis', 'No analysis available')}"
+                f"\nRetrieved Documents: {len(state.get('retrieved_docs', []))} documents found"
+            )
         elif query_type == "tool_use":
             context = f"Tool Result: {state.get('tool_result', 'No tool result')}"
         else:
             context = "This is a direct question that can be answered with general knowledge."
         
-        response_prompt = f"""
-        Provide a comprehensive answer to the user's question.
-        
-        Question: "{question}"
-        
-        {f"Previous conversation context: {memory_context[:400]}..." if memory_context else ""}
-        
-        Current Context: {context}
-        
-        Guidelines:
-        1. Be accurate and helpful
-        2. Reference previous conversation if relevant
-        3. Cite sources when available
-        4. Be conversational but professional
-        5. If information is limited, acknowledge it
-        
-        Provide a clear, well-structured response.
-        """
+        return RESPONSE_PROMPT.format(
+            question=question,
+            memory=f"Previous conversation context: {memory_context[:400]}..." if memory_context else "",
+            context=context
+        )
+
+    async def generate_response(self, state: AgentState) -> AgentState:
+        """Enhanced response generation with memory context"""
+        start_time = time.time()
+        memory_context = state.get("memory_context", "")
+        response_prompt = self._build_response_prompt(state)
         
         try:
             response = await self.llm.ainvoke([HumanMessage(content=response_prompt)])
@@ -604,11 +801,12 @@ class OptimizedInsightFlowAgent:
                 }
             })
             
-            # Update cache
-            if conversation_id in self.conversation_cache:
-                self.conversation_cache[conversation_id] += f"\n{memory_content}"
-            else:
-                self.conversation_cache[conversation_id] = memory_content
+            # Update cache; re-inserting restarts the conversation's TTL
+            entries = self.conversation_cache.get(conversation_id)
+            if entries is None:
+                entries = deque(maxlen=CONVERSATION_CACHE_ENTRIES)
+            entries.append(memory_content)
+            self.conversation_cache[conversation_id] = entries
             
             step = {
                 "node": "MemorySaver",
@@ -650,7 +848,9 @@ class OptimizedInsightFlowAgent:
             steps=[],
             conversation_id=conversation_id,
             query_type="",
-            memory_context=""
+            memory_context="",
+            prefetched_docs=None,
+            tool_result=None
         )
         
         try:
@@ -704,6 +904,113 @@ class OptimizedInsightFlowAgent:
                 }
             }
 
+    async def process_query_stream(self, question: str, conversation_id: str = "default") -> AsyncGenerator[Dict[str, Any], None]:
+        """Process a user query, streaming steps and response tokens as they are produced"""
+        start_ns = time.perf_counter_ns()
+        
+        state = AgentState(
+            messages=[HumanMessage(content=question)],
+            question=question,
+            retrieved_docs=[],
+            analysis="",
+            response="",
+            steps=[],
+            conversation_id=conversation_id,
+            query_type="",
+            memory_context="",
+            prefetched_docs=None,
+            tool_result=None
+        )
+        
+        try:
+            state = await self.parallel_prefetch(state)
+            yield {"type": "step", "step": state["steps"][-1], "progress": 20}
+            
+            # The fused call returns its answer whole, so streaming classifies on its own first
+            start_time = time.time()
+            query_type, classification_method = await self._classify_query(
+                question, state["memory_context"]
+            )
+            state["query_type"] = query_type
+            state["steps"].append({
+                "node": "QueryClassifier",
+                "status": "completed",
+                "timestamp": time.time() * 1000,
+                "data": {
+                    "query_type": query_type,
+                    "classification_reasoning": classification_method,
+                    "memory_context_used": bool(state["memory_context"]),
+                    "processing_time_ms": int((time.time() - start_time) * 1000)
+                }
+            })
+            yield {"type": "step", "step": state["steps"][-1], "progress": 35}
+            
+            if query_type == "retrieval":
+                state = await self.retrieve_documents(state)
+                yield {"type": "step", "step": state["steps"][-1], "progress": 60}
+            elif query_type == "tool_use":
+                state = await self.use_tools(state)
+                yield {"type": "step", "step": state["steps"][-1], "progress": 60}
+            
+            yield {
+                "type": "step",
+                "step": {
+                    "node": "ResponseGenerator",
+                    "status": "in_progress",
+                    "timestamp": time.time() * 1000,
+                    "data": {"streaming": True}
+                },
+                "progress": 80
+            }
+            
+            response_parts = []
+            response_length = 0
+            prompt = self._build_response_prompt(state)
+            async for chunk in self.llm.astream([HumanMessage(content=prompt)]):
+                token = chunk.content
+                if not token:
+                    continue
+                response_parts.append(token)
+                response_length += len(token)
+                yield {
+                    "type": "token",
+                    "content": token,
+                    "progress": min(95, 80 + (response_length / 10))
+                }
+            
+            state["response"] = "".join(response_parts)
+            state["messages"].append(AIMessage(content=state["response"]))
+            
+            # Persist memory without holding the final event back on the store write
+            task = asyncio.create_task(self.save_memory(state))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+            
+            # Whole run on the monotonic clock, classification and prefetch included
+            total_time = (time.perf_counter_ns() - start_ns) // 1_000_000
+            
+            yield {
+                "type": "complete",
+                "metadata": {
+                    "query_type": query_type,
+                    "total_processing_time_ms": total_time,
+                    "documents_used": len(state.get("retrieved_docs", [])),
+                    "steps_executed": len(state["steps"]) + 1,
+                    "model_used": "gemini-2.0-flash-exp",
+                    "memory_context_used": bool(state["memory_context"]),
+                    "streaming_enabled": True
+                },
+                "progress": 100
+            }
+            
+        except Exception as e:
+            logger.error(f"Error processing streaming query: {e}")
+            yield {
+                "type": "error",
+                "error": str(e),
+                "progress": 100
+            }
+
 # Global agent instance
 _agent_instance = None
 
@@ -1,13 +1,22 @@
-from typing import TypedDict, List, Dict, Any
+from typing import TypedDict, Annotated, List, Dict, Any
 from langchain.schema import BaseMessage, HumanMessage, AIMessage
-from langchain.memory import ConversationBufferMemory
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.embeddings import SentenceTransformerEmbeddings
 from langgraph.graph import StateGraph, END
+from cachetools import TTLCache
 import time
 import os
+import hashlib
+import re
 from dotenv import load_dotenv
 import logging
+import asyncio
+import functools
+import operator
+
+from graphs.common import (
+    QUERY_TYPES, RETRIEVAL_KEYWORDS, TOOL_KEYWORDS, ERROR_FALLBACK_KEYWORDS, create_retrieval_executor
+)
 
 # Load environment variables
 load_dotenv()
@@ -15,21 +24,131 @@ load_dotenv()
 # Setup logging
 logger = logging.getLogger(__name__)
 
+# Answers depend only on the question (no per-conversation memory), so repeats are served from cache
+RESPONSE_CACHE_TTL = int(os.getenv("AGENT_RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_SIZE = 1024
+
+# Bare math ("15*23", "sqrt 144", "20%") carries no keyword but still needs the calculator
+MATH_EXPRESSION = re.compile(
+    r"\d\s*[-+*/^x%]|sqrt|square root|factorial|\b(?:log|ln|sin|cos|tan)\b",
+    re.IGNORECASE
+)
+
+# Questions this short ("hi", "thanks", "gst rules") are classified by keyword without an LLM call
+SHORT_QUERY_MAX_WORDS = 2
+
+# Upper bound on graph runs in flight for a single process_queries call
+BATCH_MAX_CONCURRENCY = 32
+
+# Static prompt bodies, formatted per query
+CLASSIFICATION_PROMPT = """
+Analyze this user question and classify it into one of these categories:
+
+1. "retrieval" - Questions about specific topics that need document search:
+   - Tax rules, regulations, compliance
+   - Business expenses, deductions
+   - Legal requirements, procedures
+   - Specific industry knowledge
+   - Technical documentation
+
+2. "tool_use" - Questions needing calculations or current data:
+   - Mathematical calculations
+   - Current events, news, recent information
+   - Weather, stock prices, live data
+   - Web searches for current information
+
+3. "direct" - Questions answerable with general knowledge:
+   - General concepts, definitions
+   - Common knowledge topics
+   - Simple explanations
+   - Greetings, casual conversation
+
+Question: "{question}"
+
+Think carefully:
+- Does this ask about specific regulations, procedures, or documentation? → retrieval
+- Does this need calculation or current/live data? → tool_use  
+- Is this general knowledge or casual conversation? → direct
+
+Respond with ONLY the category name: retrieval, tool_use, or direct
+"""
+
+ANALYSIS_PROMPT = """
+Based on the following documents, analyze how they relate to the user's question.
+
+Question: "{question}"
+
+Documents:
+{context}
+
+Provide a structured analysis including:
+1. Relevance of the documents to the question
+2. Key information that answers the question
+3. Any gaps or limitations in the available information
+4. Confidence level in the answer (1-10)
+
+Keep the analysis concise but thorough.
+"""
+
+TOOL_SELECTION_PROMPT = """
+Based on this question, which tool should be used?
+
+Question: "{question}"
+
+Available tools:
+- web_search: For current information, news, or general web queries
+- calculator: For mathematical calculations
+
+Respond with the tool name and the specific query/calculation to perform.
+Format: tool_name: specific_query
+"""
+
+RESPONSE_PROMPT = """
+Please provide a comprehensive answer to the user's question.
+
+Question: "{question}"
+
+Context: {context}
+
+Guidelines:
+1. Be accurate and helpful
+2. Cite sources when available
+3. If using retrieved documents, reference them appropriately
+4. If using tool results, explain the findings clearly
+5. Be conversational but professional
+6. If information is limited, acknowledge it
+
+Provide a clear, well-structured response.
+"""
+
 
 class AgentState(TypedDict):
-    messages: List[BaseMessage]
+    # Nodes return only the keys they change; steps and messages are appended by reducer
+    messages: Annotated[List[BaseMessage], operator.add]
     question: str
     retrieved_docs: List[Dict[str, Any]]
     analysis: str
     response: str
-    steps: List[Dict[str, Any]]
+    steps: Annotated[List[Dict[str, Any]], operator.add]
     conversation_id: str
     query_type: str
+    tool_result: Any
 
 
 class RealInsightFlowAgent:
+    _instance = None
+    _initialized = False
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
     def __init__(self):
-        self.memory = ConversationBufferMemory(return_messages=True)
+        if self._initialized:
+            return
+        
+        logger.info("Initializing RealInsightFlowAgent (singleton)")
         
         # Initialize Gemini
         api_key = os.getenv("GOOGLE_API_KEY")
@@ -55,7 +174,15 @@ class RealInsightFlowAgent:
         from tools.real_tools import RealToolRegistry
         self.tools = RealToolRegistry()
         
+        self.executor = create_retrieval_executor()
+        
+        self.response_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+        
+        # Nodes are bound methods, so the compiled graph is built once with the singleton
         self.graph = self._build_graph()
+        
+        self._initialized = True
+        logger.info("RealInsightFlowAgent initialized successfully")
     
     def _build_graph(self) -> StateGraph:
         graph = StateGraph(AgentState)
@@ -86,74 +213,41 @@ class RealInsightFlowAgent:
         # Set entry point
         graph.set_entry_point("classify_query")
         
-        return graph.compile()
+        # Compilation is a one-off startup cost; time it apart from per-query node timings
+        compile_start = time.perf_counter_ns()
+        compiled = graph.compile()
+        self.graph_compile_ms = (time.perf_counter_ns() - compile_start) / 1_000_000
+        logger.info(f"Real agent graph compiled in {self.graph_compile_ms:.1f}ms")
+        
+        return compiled
     
-    def classify_query(self, state: AgentState) -> AgentState:
+    async def classify_query(self, state: AgentState) -> Dict[str, Any]:
         """Classify the user query to determine processing path"""
-        start_time = time.time()
+        start_time = time.perf_counter()
         question = state["question"]
         
-        classification_prompt = f"""
-        Analyze this user question and classify it into one of these categories:
-        
-        1. "retrieval" - Questions about specific topics that need document search:
-           - Tax rules, regulations, compliance
-           - Business expenses, deductions
-           - Legal requirements, procedures
-           - Specific industry knowledge
-           - Technical documentation
-        
-        2. "tool_use" - Questions needing calculations or current data:
-           - Mathematical calculations
-           - Current events, news, recent information
-           - Weather, stock prices, live data
-           - Web searches for current information
+        classification_text = None
         
-        3. "direct" - Questions answerable with general knowledge:
-           - General concepts, definitions
-           - Common knowledge topics
-           - Simple explanations
-           - Greetings, casual conversation
-        
-        Question: "{question}"
-        
-        Think carefully:
-        - Does this ask about specific regulations, procedures, or documentation? → retrieval
-        - Does this need calculation or current/live data? → tool_use  
-        - Is this general knowledge or casual conversation? → direct
-        
-        Respond with ONLY the category name: retrieval, tool_use, or direct
-        """
-        
-        try:
-            response = self.llm.invoke([HumanMessage(content=classification_prompt)])
-            classification_text = response.content.strip().lower()
-            
-            # More precise classification parsing
-            if classification_text.startswith("retrieval") or "retrieval" == classification_text:
-                query_type = "retrieval"
-            elif classification_text.startswith("tool_use") or "tool_use" == classification_text:
-                query_type = "tool_use"
-            elif classification_text.startswith("direct") or "direct" == classification_text:
-                query_type = "direct"
-            else:
-                # Fallback analysis based on keywords
-                question_lower = question.lower()
-                if any(keyword in question_lower for keyword in ["tax", "deduction", "business expense", "regulation", "legal", "rule", "requirement", "compliance", "GST", "HST", "freelancer"]):
-                    query_type = "retrieval"
-                elif any(keyword in question_lower for keyword in ["calculate", "compute", "what is", "weather", "price", "current", "today", "recent", "news"]):
-                    query_type = "tool_use"
-                else:
-                    query_type = "direct"
+        if len(question.split()) <= SHORT_QUERY_MAX_WORDS:
+            # Too little text for the LLM to improve on the keyword rules; skip the round-trip
+            query_type = self._classify_by_keywords(question)
+            classification_text = "short query keyword classification"
+        else:
+            try:
+                classification_prompt = CLASSIFICATION_PROMPT.format(question=question)
+                response = await self.llm.ainvoke([HumanMessage(content=classification_prompt)])
+                classification_text = response.content.strip().lower()
                 
-        except Exception as e:
-            logger.error(f"Error in query classification: {e}")
-            # Intelligent fallback based on question content
-            question_lower = question.lower()
-            if any(keyword in question_lower for keyword in ["tax", "deduction", "business", "legal", "rule", "regulation"]):
-                query_type = "retrieval"
-            else:
-                query_type = "direct"
+                # Take the label the answer starts with (an exact answer is a prefix of itself)
+                query_type = next((label for label in QUERY_TYPES if classification_text.startswith(label)), None)
+                if query_type is None:
+                    # Fallback analysis based on keywords
+                    query_type = self._classify_by_keywords(question)
+                    
+            except Exception as e:
+                logger.error(f"Error in query classification: {e}")
+                # Intelligent fallback based on question content
+                query_type = "retrieval" if ERROR_FALLBACK_KEYWORDS.search(question) else "direct"
         
         step = {
             "node": "QueryClassifier",
@@ -161,29 +255,42 @@ class RealInsightFlowAgent:
             "timestamp": time.time() * 1000,
             "data": {
                 "query_type": query_type,
-                "classification_reasoning": classification_text if 'classification_text' in locals() else "fallback classification",
-                "processing_time_ms": int((time.time() - start_time) * 1000)
+                "classification_reasoning": classification_text or "fallback classification",
+                "processing_time_ms": int((time.perf_counter() - start_time) * 1000)
             }
         }
         
-        state["steps"].append(step)
-        state["query_type"] = query_type
-        state["messages"] = [HumanMessage(content=question)]
-        
-        return state
+        return {
+            "steps": [step],
+            "query_type": query_type,
+            "messages": [HumanMessage(content=question)]
+        }
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _classify_by_keywords(question: str) -> str:
+        """Rule-based query type for when the LLM classification is skipped or unusable"""
+        if RETRIEVAL_KEYWORDS.search(question):
+            return "retrieval"
+        if TOOL_KEYWORDS.search(question) or MATH_EXPRESSION.search(question):
+            return "tool_use"
+        return "direct"
     
     def _route_query(self, state: AgentState) -> str:
         """Route based on query classification"""
         return state.get("query_type", "direct")
     
-    def retrieve_documents(self, state: AgentState) -> AgentState:
+    async def retrieve_documents(self, state: AgentState) -> Dict[str, Any]:
         """Retrieve relevant documents using real vector search"""
-        start_time = time.time()
+        start_time = time.perf_counter()
         question = state["question"]
         
         try:
             # Perform real similarity search
-            docs = self.vector_store.similarity_search(question, k=5)
+            docs = await asyncio.get_running_loop().run_in_executor(
+                self.executor,
+                functools.partial(self.vector_store.similarity_search, question, k=5)
+            )
             
             step = {
                 "node": "DocumentRetriever",
@@ -193,13 +300,10 @@ class RealInsightFlowAgent:
                     "documents_found": len(docs),
                     "avg_similarity_score": sum(doc.get("score", 0) for doc in docs) / len(docs) if docs else 0,
                     "sources": [doc.get("metadata", {}).get("source", "unknown") for doc in docs],
-                    "processing_time_ms": int((time.time() - start_time) * 1000)
+                    "processing_time_ms": int((time.perf_counter() - start_time) * 1000)
                 }
             }
             
-            state["steps"].append(step)
-            state["retrieved_docs"] = docs
-            
         except Exception as e:
             logger.error(f"Error in document retrieval: {e}")
             
@@ -210,34 +314,31 @@ class RealInsightFlowAgent:
                 "data": {
                     "error": str(e),
                     "documents_found": 0,
-                    "processing_time_ms": int((time.time() - start_time) * 1000)
+                    "processing_time_ms": int((time.perf_counter() - start_time) * 1000)
                 }
             }
             
-            state["steps"].append(step)
-            state["retrieved_docs"] = []
+            docs = []
         
-        return state
+        return {"steps": [step], "retrieved_docs": docs}
     
-    def analyze_context(self, state: AgentState) -> AgentState:
+    async def analyze_context(self, state: AgentState) -> Dict[str, Any]:
         """Analyze retrieved documents and form reasoning"""
-        start_time = time.time()
+        start_time = time.perf_counter()
         question = state["question"]
         docs = state["retrieved_docs"]
         
         if not docs:
-            state["analysis"] = "No relevant documents found for analysis."
             step = {
                 "node": "ContextAnalyzer",
                 "status": "completed",
                 "timestamp": time.time() * 1000,
                 "data": {
                     "analysis_type": "no_documents",
-                    "processing_time_ms": int((time.time() - start_time) * 1000)
+                    "processing_time_ms": int((time.perf_counter() - start_time) * 1000)
                 }
             }
-            state["steps"].append(step)
-            return state
+            return {"steps": [step], "analysis": "No relevant documents found for analysis."}
         
         # Create context from documents
         context = "\n\n".join([
@@ -245,25 +346,10 @@ class RealInsightFlowAgent:
             for i, doc in enumerate(docs[:3])  # Use top 3 documents
         ])
         
-        analysis_prompt = f"""
-        Based on the following documents, analyze how they relate to the user's question.
-        
-        Question: "{question}"
-        
-        Documents:
-        {context}
-        
-        Provide a structured analysis including:
-        1. Relevance of the documents to the question
-        2. Key information that answers the question
-        3. Any gaps or limitations in the available information
-        4. Confidence level in the answer (1-10)
-        
-        Keep the analysis concise but thorough.
-        """
+        analysis_prompt = ANALYSIS_PROMPT.format(question=question, context=context)
         
         try:
-            response = self.llm.invoke([HumanMessage(content=analysis_prompt)])
+            response = await self.llm.ainvoke([HumanMessage(content=analysis_prompt)])
             analysis = response.content
             
             step = {
@@ -274,7 +360,7 @@ class RealInsightFlowAgent:
                     "analysis_type": "document_analysis",
                     "documents_analyzed": len(docs),
                     "analysis_length": len(analysis),
-                    "processing_time_ms": int((time.time() - start_time) * 1000)
+                    "processing_time_ms": int((time.perf_counter() - start_time) * 1000)
                 }
             }
             
@@ -288,36 +374,22 @@ class RealInsightFlowAgent:
                 "timestamp": time.time() * 1000,
                 "data": {
                     "error": str(e),
-                    "processing_time_ms": int((time.time() - start_time) * 1000)
+                    "processing_time_ms": int((time.perf_counter() - start_time) * 1000)
                 }
             }
         
-        state["steps"].append(step)
-        state["analysis"] = analysis
-        
-        return state
+        return {"steps": [step], "analysis": analysis}
     
-    def use_tools(self, state: AgentState) -> AgentState:
+    async def use_tools(self, state: AgentState) -> Dict[str, Any]:
         """Use appropriate tools based on query type"""
-        start_time = time.time()
+        start_time = time.perf_counter()
         question = state["question"]
         
         # Determine which tool to use
-        tool_selection_prompt = f"""
-        Based on this question, which tool should be used?
-        
-        Question: "{question}"
-        
-        Available tools:
-        - web_search: For current information, news, or general web queries
-        - calculator: For mathematical calculations
-        
-        Respond with the tool name and the specific query/calculation to perform.
-        Format: tool_name: specific_query
-        """
+        tool_selection_prompt = TOOL_SELECTION_PROMPT.format(question=question)
         
         try:
-            response = self.llm.invoke([HumanMessage(content=tool_selection_prompt)])
+            response = await self.llm.ainvoke([HumanMessage(content=tool_selection_prompt)])
             tool_instruction = response.content.strip()
             
             tool_result = None
@@ -326,7 +398,7 @@ class RealInsightFlowAgent:
                 tool_result = self.tools.execute_tool("calculator", "calculate", expression=expression)
             elif "web_search:" in tool_instruction.lower():
                 query = tool_instruction.split(":", 1)[1].strip()
-                tool_result = self.tools.execute_tool("web_search", "search", query=query)
+                tool_result = await self.tools.aexecute_tool("web_search", "search", query=query)
             
             step = {
                 "node": "ToolUser",
@@ -335,13 +407,10 @@ class RealInsightFlowAgent:
                 "data": {
                     "tool_selected": tool_instruction.split(":")[0] if ":" in tool_instruction else "none",
                     "tool_result": str(tool_result)[:200] if tool_result else "No result",
-                    "processing_time_ms": int((time.time() - start_time) * 1000)
+                    "processing_time_ms": int((time.perf_counter() - start_time) * 1000)
                 }
             }
             
-            # Store tool result for response generation
-            state["tool_result"] = tool_result
-            
         except Exception as e:
             logger.error(f"Error using tools: {e}")
             
@@ -351,18 +420,18 @@ class RealInsightFlowAgent:
                 "timestamp": time.time() * 1000,
                 "data": {
                     "error": str(e),
-                    "processing_time_ms": int((time.time() - start_time) * 1000)
+                    "processing_time_ms": int((time.perf_counter() - start_time) * 1000)
                 }
             }
             
-            state["tool_result"] = None
+            tool_result = None
         
-        state["steps"].append(step)
-        return state
+        # Store tool result for response generation
+        return {"steps": [step], "tool_result": tool_result}
     
-    def generate_response(self, state: AgentState) -> AgentState:
+    async def generate_response(self, state: AgentState) -> Dict[str, Any]:
         """Generate final response using Gemini"""
-        start_time = time.time()
+        start_time = time.perf_counter()
         question = state["question"]
         query_type = state.get("query_type", "direct")
         
@@ -378,26 +447,10 @@ class RealInsightFlowAgent:
         else:
             context = "This is a direct question that can be answered with general knowledge."
         
-        response_prompt = f"""
-        Please provide a comprehensive answer to the user's question.
-        
-        Question: "{question}"
-        
-        Context: {context}
-        
-        Guidelines:
-        1. Be accurate and helpful
-        2. Cite sources when available
-        3. If using retrieved documents, reference them appropriately
-        4. If using tool results, explain the findings clearly
-        5. Be conversational but professional
-        6. If information is limited, acknowledge it
-        
-        Provide a clear, well-structured response.
-        """
+        response_prompt = RESPONSE_PROMPT.format(question=question, context=context)
         
         try:
-            response = self.llm.invoke([HumanMessage(content=response_prompt)])
+            response = await self.llm.ainvoke([HumanMessage(content=response_prompt)])
             final_response = response.content
             
             step = {
@@ -408,7 +461,7 @@ class RealInsightFlowAgent:
                     "response_length": len(final_response),
                     "word_count": len(final_response.split()),
                     "sources_referenced": len(state.get('retrieved_docs', [])),
-                    "processing_time_ms": int((time.time() - start_time) * 1000)
+                    "processing_time_ms": int((time.perf_counter() - start_time) * 1000)
                 }
             }
             
@@ -422,19 +475,33 @@ class RealInsightFlowAgent:
                 "timestamp": time.time() * 1000,
                 "data": {
                     "error": str(e),
-                    "processing_time_ms": int((time.time() - start_time) * 1000)
+                    "processing_time_ms": int((time.perf_counter() - start_time) * 1000)
                 }
             }
         
-        state["steps"].append(step)
-        state["response"] = final_response
-        state["messages"].append(AIMessage(content=final_response))
-        
-        return state
+        return {
+            "steps": [step],
+            "response": final_response,
+            "messages": [AIMessage(content=final_response)]
+        }
+
+    @staticmethod
+    def _cache_key(question: str) -> str:
+        """Normalize case and whitespace so trivially different phrasings share an entry"""
+        return hashlib.md5(" ".join(question.lower().split()).encode()).hexdigest()
 
     async def process_query(self, question: str, conversation_id: str = "default") -> Dict[str, Any]:
         """Process a user query through the real agent graph"""
         
+        cache_key = self._cache_key(question)
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            return {
+                **cached,
+                "conversation_id": conversation_id,
+                "metadata": {**cached["metadata"], "cache_hit": True}
+            }
+        
         # Initialize state
         initial_state = AgentState(
             messages=[],
@@ -444,33 +511,41 @@ class RealInsightFlowAgent:
             response="",
             steps=[],
             conversation_id=conversation_id,
-            query_type=""
+            query_type="",
+            tool_result=None
         )
         
         try:
             # Run the graph
-            result = self.graph.invoke(initial_state)
+            started = time.perf_counter_ns()
+            result = await self.graph.ainvoke(initial_state)
             
-            # Calculate total processing time
-            total_time = 0
-            if result["steps"]:
-                start_time = result["steps"][0]["timestamp"]
-                end_time = result["steps"][-1]["timestamp"]
-                total_time = int(end_time - start_time)
+            # Step timestamps are wall-clock for display; latency uses the monotonic clock
+            # and, unlike first-to-last step deltas, includes the first node's own work
+            total_time = (time.perf_counter_ns() - started) // 1_000_000
             
-            return {
+            steps = result["steps"]
+            response = {
                 "answer": result["response"],
-                "steps": result["steps"],
+                "steps": steps,
                 "conversation_id": conversation_id,
                 "metadata": {
-                    "query_type": result.get("query_type", "unknown"),
+                    "query_type": result["query_type"] or "unknown",
                     "total_processing_time_ms": total_time,
-                    "documents_used": len(result.get("retrieved_docs", [])),
-                    "steps_executed": len(result["steps"]),
-                    "model_used": "gemini-2.0-flash-exp"
+                    "documents_used": len(result["retrieved_docs"]),
+                    "steps_executed": len(steps),
+                    "model_used": "gemini-2.0-flash-exp",
+                    "cache_hit": False
                 }
             }
             
+            # Don't pin a failed LLM or retrieval call in the cache, nor live tool
+            # results (weather, news, time) that go stale within the TTL
+            if result["query_type"] != "tool_use" and all(step["status"] == "completed" for step in steps):
+                self.response_cache[cache_key] = response
+            
+            return response
+            
         except Exception as e:
             logger.error(f"Error processing query: {e}")
             
@@ -492,4 +567,31 @@ class RealInsightFlowAgent:
                     "steps_executed": 1,
                     "model_used": "gemini-2.0-flash-exp"
                 }
-            }
\ No newline at end of file
+            }
+
+    async def process_queries(self, questions: List[str], conversation_id: str = "default") -> List[Dict[str, Any]]:
+        """Process several queries concurrently; results are returned in input order"""
+        semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+        
+        async def run(question: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.process_query(question, conversation_id)
+        
+        # Duplicates within a batch would all miss the cache at once, so run each distinct question once
+        keys = [self._cache_key(question) for question in questions]
+        unique = dict(zip(keys, questions))
+        
+        results = await asyncio.gather(*(run(question) for question in unique.values()))
+        by_key = dict(zip(unique.keys(), results))
+        
+        return [by_key[key] for key in keys]
+
+# Global agent instance
+_agent_instance = None
+
+def get_real_agent():
+    """Get or create the singleton agent instance"""
+    global _agent_instance
+    if _agent_instance is None:
+        _agent_instance = RealInsightFlowAgent()
+    return _agent_instance
@@ -10,7 +10,7 @@ import logging
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 import functools
-import json
+import re
 
 # Load environment variables
 load_dotenv()
@@ -18,6 +18,21 @@ load_dotenv()
 # Setup logging
 logger = logging.getLogger(__name__)
 
+# Keyword routing rules, each matched in a single pass over the text
+# Greetings match whole words only, so "hi" doesn't fire on "this" or "hey" on "they"
+GREETING_KEYWORDS = re.compile(
+    r"\b(?:hello|hi|hey|good morning|good afternoon|good evening"
+    r"|how are you|what's up|thanks|thank you|bye|goodbye)\b",
+    re.IGNORECASE
+)
+RETRIEVAL_KEYWORDS = re.compile(
+    r"tax|deduction|business expense|regulation|legal|rule|requirement|compliance|gst|hst|freelancer"
+    r"|rate|bracket|income tax|document|policy|guideline"
+    r"|explain|what is|how to|define|meaning|example",
+    re.IGNORECASE
+)
+FOLLOW_UP_RETRIEVAL_KEYWORDS = re.compile(r"tax|deduction|business|legal|rule", re.IGNORECASE)
+
 class AgentState(TypedDict):
     messages: List[BaseMessage]
     question: str
@@ -200,17 +215,9 @@ class StreamingInsightFlowAgent:
         
         # Simplified classification: Only RAG and Direct responses
         # First check for simple greetings and conversational queries
-        if any(greeting in question_lower for greeting in [
-            "hello", "hi", "hey", "good morning", "good afternoon", "good evening",
-            "how are you", "what's up", "thanks", "thank you", "bye", "goodbye"
-        ]):
+        if GREETING_KEYWORDS.search(question_lower):
             query_type = "direct"
-        elif any(keyword in combined_text for keyword in [
-            "tax", "deduction", "business expense", "regulation", "legal", 
-            "rule", "requirement", "compliance", "GST", "HST", "freelancer",
-            "rate", "bracket", "income tax", "document", "policy", "guideline",
-            "explain", "what is", "how to", "define", "meaning", "example"
-        ]):
+        elif RETRIEVAL_KEYWORDS.search(combined_text):
             query_type = "retrieval"
         else:
             # Check if question is contextual (short questions that need previous context)
@@ -219,9 +226,7 @@ class StreamingInsightFlowAgent:
                 last_topic = history[-1] if history else {}
                 if 'question' in last_topic:
                     last_q = last_topic['question'].lower()
-                    if any(keyword in last_q for keyword in [
-                        "tax", "deduction", "business", "legal", "rule"
-                    ]):
+                    if FOLLOW_UP_RETRIEVAL_KEYWORDS.search(last_q):
                         query_type = "retrieval"
                     else:
                         query_type = "direct"
@@ -260,7 +265,7 @@ class StreamingInsightFlowAgent:
         
         try:
             # Run retrieval in thread pool
-            loop = asyncio.get_event_loop()
+            loop = asyncio.get_running_loop()
             docs = await loop.run_in_executor(
                 self.executor,
                 functools.partial(self.vector_store.similarity_search, question, k=3)
@@ -1,14 +1,14 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, ORJSONResponse
 from fastapi.security import HTTPBearer
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import uvicorn
 import logging
 import asyncio
-import json
 import time
+import orjson
 from contextlib import asynccontextmanager
 from datetime import timedelta
 from sse_starlette.sse import EventSourceResponse
@@ -17,10 +17,11 @@ from sse_starlette.sse import EventSourceResponse
 from auth.auth_utils import (
     authenticate_admin, 
     create_access_token, 
-    admin_required,
+    get_current_admin,
     get_password_hash,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
+from auth import clerk_auth
 
 # Import multi-tenant components
 from database.database import create_tables
@@ -39,10 +40,13 @@ async def lifespan(app: FastAPI):
     logger.info("Initializing multi-tenant platform...")
     
     try:
-        # Initialize database tables
+        # Initialize database tables once per process (schema changes go through Alembic)
         create_tables()
         logger.info("✅ Database tables initialized")
         
+        # Open the shared HTTP client used for Clerk JWKS fetches
+        await clerk_auth.startup()
+        
         # Initialize streaming agent (primary)
         from graphs.streaming_agent_graph import get_streaming_agent
         streaming_agent_instance = get_streaming_agent()
@@ -64,12 +68,14 @@ async def lifespan(app: FastAPI):
     yield
     # Shutdown: cleanup if needed
     logger.info("Shutting down...")
+    await clerk_auth.shutdown()
 
 app = FastAPI(
     title="InsightFlow Backend - Enhanced", 
     version="3.0.0", 
     description="AI Agent platform with streaming, vector database, and admin dashboard",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware - allowing all origins for public API access
@@ -181,10 +187,10 @@ async def stream_query(request: StreamQueryRequest):
                 question=request.question,
                 conversation_id=request.conversation_id or "default"
             ):
-                yield f"data: {json.dumps(chunk)}\n\n"
+                yield f"data: {orjson.dumps(chunk).decode()}\n\n"
         except Exception as e:
             logger.error(f"Error in streaming query: {e}")
-            yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+            yield f"data: {orjson.dumps({'type': 'error', 'error': str(e)}).decode()}\n\n"
     
     return EventSourceResponse(generate())
 
@@ -287,8 +293,9 @@ async def upload_document(file: UploadFile = File(...)):
             error=str(e)
         )
 
+# ChromaDB calls block, so vector store handlers are plain def and run in the threadpool
 @app.get("/documents/list")
-async def list_documents():
+def list_documents():
     """List all documents in vector store"""
     global vector_store_instance
     
@@ -303,7 +310,7 @@ async def list_documents():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/documents/stats")
-async def get_document_stats():
+def get_document_stats():
     """Get vector store statistics"""
     global vector_store_instance
     
@@ -321,7 +328,7 @@ async def get_document_stats():
 @app.post("/admin/documents/upload", response_model=DocumentUploadResponse)
 async def admin_upload_document(
     file: UploadFile = File(...),
-    current_admin: str = Depends(admin_required)
+    current_admin: str = Depends(get_current_admin)
 ):
     """Admin upload document to vector store"""
     global vector_store_instance
@@ -385,9 +392,9 @@ async def admin_upload_document(
         )
 
 @app.delete("/admin/documents/{document_id}")
-async def admin_delete_document(
+def admin_delete_document(
     document_id: str,
-    current_admin: str = Depends(admin_required)
+    current_admin: str = Depends(get_current_admin)
 ):
     """Admin delete document from vector store"""
     global vector_store_instance
@@ -408,7 +415,7 @@ async def admin_delete_document(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/admin/documents/reset")
-async def admin_reset_vector_store(current_admin: str = Depends(admin_required)):
+def admin_reset_vector_store(current_admin: str = Depends(get_current_admin)):
     """Admin reset entire vector store"""
     global vector_store_instance
     
@@ -426,7 +433,7 @@ async def admin_reset_vector_store(current_admin: str = Depends(admin_required))
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/admin/dashboard/stats")
-async def admin_dashboard_stats(current_admin: str = Depends(admin_required)):
+def admin_dashboard_stats(current_admin: str = Depends(get_current_admin)):
     """Get comprehensive stats for admin dashboard"""
     global vector_store_instance, streaming_agent_instance, agent_instance
     
@@ -541,7 +548,7 @@ async def list_tools():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/tools/{tool_name}/{method}")
-async def execute_tool(tool_name: str, method: str, params: Dict[str, Any]):
+def execute_tool(tool_name: str, method: str, params: Dict[str, Any]):
     """Execute a tool method"""
     try:
         from tools.real_tools import RealToolRegistry
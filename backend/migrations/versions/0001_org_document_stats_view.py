@@ -0,0 +1,45 @@
+"""Add per-organization document stats materialized view
+
+Revision ID: 0001_org_document_stats_view
+Revises: 
+Create Date: 2026-10-16 09:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0001_org_document_stats_view'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Materialized views are PostgreSQL only; SQLite keeps the live aggregate
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    op.execute("""
+        CREATE MATERIALIZED VIEW mv_org_document_stats AS
+        SELECT
+            org_id,
+            count(*) AS total,
+            count(*) FILTER (WHERE processing_status = 'completed') AS processed,
+            count(*) FILTER (WHERE processing_status = 'processing') AS processing,
+            count(*) FILTER (WHERE processing_status = 'failed') AS failed,
+            coalesce(sum(file_size), 0) AS total_size,
+            coalesce(sum(chunks_created) FILTER (WHERE processing_status = 'completed'), 0) AS total_chunks,
+            now() AS last_refreshed
+        FROM documents
+        GROUP BY org_id
+    """)
+    # Unique index is required for REFRESH ... CONCURRENTLY
+    op.execute("CREATE UNIQUE INDEX ix_mv_org_document_stats_org_id ON mv_org_document_stats (org_id)")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    op.execute("DROP MATERIALIZED VIEW IF EXISTS mv_org_document_stats")
@@ -0,0 +1,45 @@
+"""Add composite indexes for per-org document analytics
+
+Revision ID: 0002_document_analytics_indexes
+Revises: 0001_org_document_stats_view
+Create Date: 2026-10-16 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_document_analytics_indexes'
+down_revision = '0001_org_document_stats_view'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        op.create_index("idx_docs_org_status", "documents", ["org_id", "processing_status"], if_not_exists=True)
+        op.create_index("idx_docs_org_upload", "documents", ["org_id", sa.text("upload_date DESC")], if_not_exists=True)
+        return
+
+    # CONCURRENTLY avoids locking documents against writes, but can't run in a transaction
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_docs_org_status "
+            "ON documents (org_id, processing_status) INCLUDE (file_size, chunks_created)"
+        )
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_docs_org_upload "
+            "ON documents (org_id, upload_date DESC) INCLUDE (file_size, file_type)"
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        op.drop_index("idx_docs_org_upload", table_name="documents", if_exists=True)
+        op.drop_index("idx_docs_org_status", table_name="documents", if_exists=True)
+        return
+
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_docs_org_upload")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_docs_org_status")
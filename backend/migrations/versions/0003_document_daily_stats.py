@@ -0,0 +1,46 @@
+"""Add daily document upload rollup table
+
+Revision ID: 0003_document_daily_stats
+Revises: 0002_document_analytics_indexes
+Create Date: 2026-10-16 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_document_daily_stats'
+down_revision = '0002_document_analytics_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+
+    # Development databases may already have the table from create_tables()
+    if not sa.inspect(bind).has_table("document_daily_stats"):
+        op.create_table(
+            "document_daily_stats",
+            sa.Column("org_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("organizations.org_id"), primary_key=True),
+            sa.Column("day", sa.Date(), primary_key=True),
+            sa.Column("document_count", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("total_size", sa.BigInteger(), nullable=False, server_default="0"),
+        )
+
+    # Backfill from existing documents; afterwards uploads/deletes keep it current
+    has_rows = bind.execute(sa.text("SELECT 1 FROM document_daily_stats LIMIT 1")).first()
+    if not has_rows:
+        op.execute("""
+            INSERT INTO document_daily_stats (org_id, day, document_count, total_size)
+            SELECT org_id, date(upload_date), count(*), coalesce(sum(file_size), 0)
+            FROM documents
+            WHERE upload_date IS NOT NULL
+            GROUP BY org_id, date(upload_date)
+        """)
+
+
+def downgrade() -> None:
+    op.drop_table("document_daily_stats")
@@ -0,0 +1,57 @@
+"""Index tenant and foreign key columns
+
+Revision ID: 0004_tenant_fk_indexes
+Revises: 0003_document_daily_stats
+Create Date: 2026-10-16 12:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_tenant_fk_indexes'
+down_revision = '0003_document_daily_stats'
+branch_labels = None
+depends_on = None
+
+
+# (index name, table, columns)
+INDEXES = [
+    ("idx_users_org", "users", ["org_id"]),
+    ("idx_docs_uploaded_by", "documents", ["uploaded_by"]),
+    ("idx_embeddings_org_doc", "document_embeddings", ["org_id", "document_id"]),
+    ("idx_embeddings_doc", "document_embeddings", ["document_id"]),
+    ("idx_sessions_org", "user_sessions", ["org_id"]),
+    ("idx_sessions_user", "user_sessions", ["user_id"]),
+    ("idx_search_logs_org_ts", "search_logs", ["org_id", "timestamp"]),
+    ("idx_search_logs_session", "search_logs", ["session_id"]),
+    ("idx_search_logs_user", "search_logs", ["user_id"]),
+    ("idx_search_logs_ts", "search_logs", ["timestamp"]),
+    ("idx_usage_org_period", "usage", ["org_id", "period_start"]),
+]
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, if_not_exists=True)
+        return
+
+    # CONCURRENTLY avoids locking tables against writes, but can't run in a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} '
+                f'ON {table} ({", ".join(columns)})'
+            )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True)
+        return
+
+    with op.get_context().autocommit_block():
+        for name, _, _ in reversed(INDEXES):
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
@@ -0,0 +1,51 @@
+"""Store JSON columns as JSONB and index document metadata
+
+Revision ID: 0005_jsonb_columns
+Revises: 0004_tenant_fk_indexes
+Create Date: 2026-10-16 13:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_jsonb_columns'
+down_revision = '0004_tenant_fk_indexes'
+branch_labels = None
+depends_on = None
+
+
+# (table, column)
+JSON_COLUMNS = [
+    ("organizations", "settings"),
+    ("documents", "doc_metadata"),
+    ("document_embeddings", "chunk_metadata"),
+    ("search_logs", "documents_used"),
+    ("search_logs", "search_metadata"),
+]
+
+
+def upgrade() -> None:
+    # SQLite has no JSONB; the model keeps plain JSON there
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    for table, column in JSON_COLUMNS:
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE jsonb USING {column}::jsonb")
+
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_docs_metadata_gin "
+            "ON documents USING gin (doc_metadata)"
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_docs_metadata_gin")
+
+    for table, column in JSON_COLUMNS:
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE json USING {column}::json")
@@ -0,0 +1,62 @@
+"""Give timestamp columns database-side UTC defaults
+
+Revision ID: 0006_server_side_timestamps
+Revises: 0005_jsonb_columns
+Create Date: 2026-10-16 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_server_side_timestamps'
+down_revision = '0005_jsonb_columns'
+branch_labels = None
+depends_on = None
+
+
+# table -> timestamp columns now stamped by the database
+TIMESTAMP_COLUMNS = {
+    "organizations": ["created_at", "updated_at"],
+    "users": ["created_at", "updated_at"],
+    "documents": ["upload_date"],
+    "document_embeddings": ["created_at"],
+    "user_sessions": ["created_at", "last_active"],
+    "search_logs": ["timestamp"],
+    "usage": ["created_at"],
+}
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        for table, columns in TIMESTAMP_COLUMNS.items():
+            for column in columns:
+                op.execute(
+                    f"ALTER TABLE {table} ALTER COLUMN {column} "
+                    f"SET DEFAULT TIMEZONE('utc', CURRENT_TIMESTAMP)"
+                )
+        return
+
+    # SQLite can't alter a column default in place; batch mode rebuilds the table
+    for table, columns in TIMESTAMP_COLUMNS.items():
+        with op.batch_alter_table(table) as batch_op:
+            for column in columns:
+                batch_op.alter_column(
+                    column,
+                    existing_type=sa.DateTime(),
+                    server_default=sa.text("CURRENT_TIMESTAMP")
+                )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        for table, columns in TIMESTAMP_COLUMNS.items():
+            for column in columns:
+                op.execute(f"ALTER TABLE {table} ALTER COLUMN {column} DROP DEFAULT")
+        return
+
+    for table, columns in TIMESTAMP_COLUMNS.items():
+        with op.batch_alter_table(table) as batch_op:
+            for column in columns:
+                batch_op.alter_column(column, existing_type=sa.DateTime(), server_default=None)
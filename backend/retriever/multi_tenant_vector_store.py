@@ -13,6 +13,9 @@ import os
 
 logger = logging.getLogger(__name__)
 
+# Chunks encoded per model forward pass; matches the upload pipeline's insert batches
+EMBEDDING_BATCH_SIZE = 64
+
 class MultiTenantVectorStore:
     """
     Vector store with complete organization isolation
@@ -22,9 +25,13 @@ class MultiTenantVectorStore:
     def __init__(self, persist_directory: str = "./data/multitenant_chroma_db"):
         self.persist_directory = persist_directory
         self.embeddings = SentenceTransformerEmbeddings(
-            model_name="all-MiniLM-L6-v2"
+            model_name="all-MiniLM-L6-v2",
+            encode_kwargs={"batch_size": EMBEDDING_BATCH_SIZE}
         )
         
+        # Collection handles per organization, so batched inserts skip the lookup
+        self.collections: Dict[str, Any] = {}
+        
         # Initialize ChromaDB client
         try:
             self.client = chromadb.PersistentClient(
@@ -52,6 +59,9 @@ class MultiTenantVectorStore:
         """Get or create collection for specific organization"""
         collection_name = self.get_collection_name(org_id)
         
+        if collection_name in self.collections:
+            return self.collections[collection_name]
+        
         try:
             # Try to get existing collection
             collection = self.client.get_collection(name=collection_name)
@@ -64,13 +74,15 @@ class MultiTenantVectorStore:
             )
             logger.info(f"Created new collection: {collection_name} for org {org_id}")
         
+        self.collections[collection_name] = collection
         return collection
     
     def add_documents(
         self, 
         org_id: uuid.UUID, 
         documents: List[Document], 
-        document_id: uuid.UUID
+        document_id: uuid.UUID,
+        start_index: int = 0
     ) -> Dict[str, Any]:
         """
         Add documents to organization's vector store
@@ -79,10 +91,18 @@ class MultiTenantVectorStore:
             org_id: Organization UUID
             documents: List of Document objects (chunks)
             document_id: UUID of the source document
+            start_index: Chunk index of the first document, for batched inserts
             
         Returns:
             Processing results
         """
+        if not documents:
+            return {
+                "success": True,
+                "chunks_added": 0,
+                "document_id": str(document_id)
+            }
+        
         try:
             collection = self.get_org_collection(org_id)
             
@@ -91,7 +111,7 @@ class MultiTenantVectorStore:
             metadatas = []
             ids = []
             
-            for i, doc in enumerate(documents):
+            for i, doc in enumerate(documents, start=start_index):
                 # Create unique ID for each chunk
                 chunk_id = f"{document_id}_{i}"
                 
@@ -106,10 +126,10 @@ class MultiTenantVectorStore:
                 metadatas.append(metadata)
                 ids.append(chunk_id)
             
-            # Generate embeddings
+            # Generate embeddings for the whole batch in one model call
             embeddings = self.embeddings.embed_documents(texts)
             
-            # Add to ChromaDB
+            # Single bulk insert into ChromaDB
             collection.add(
                 embeddings=embeddings,
                 documents=texts,
@@ -269,6 +289,7 @@ class MultiTenantVectorStore:
             
             # Delete the entire collection
             self.client.delete_collection(name=collection_name)
+            self.collections.pop(collection_name, None)
             
             logger.warning(f"Deleted entire collection for org {org_id}")
             
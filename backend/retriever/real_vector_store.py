@@ -40,6 +40,26 @@ class RealVectorStore:
             self.dimension = len(test_embedding)
         return self.dimension
     
+    def _create_index(self, dimension: int):
+        """
+        Create an int8 scalar-quantized inner-product index
+        Stores 1 byte per dimension instead of 4; vectors are L2-normalized, so
+        every component lies in [-1, 1] and the quantizer is trained on that
+        fixed range rather than on whichever batch happens to arrive first
+        """
+        index = faiss.IndexScalarQuantizer(
+            dimension,
+            faiss.ScalarQuantizer.QT_8bit_uniform,
+            faiss.METRIC_INNER_PRODUCT  # Inner product for similarity
+        )
+        bounds = np.vstack([
+            np.full(dimension, -1.0, dtype='float32'),
+            np.full(dimension, 1.0, dtype='float32')
+        ])
+        index.sq.rangestat = faiss.ScalarQuantizer.RS_minmax
+        index.train(bounds)
+        return index
+    
     def _initialize_sample_documents(self):
         """Initialize with sample tax documents for demonstration"""
         sample_docs = [
@@ -219,13 +239,13 @@ class RealVectorStore:
         # Initialize or update FAISS index
         dimension = self._get_embedding_dimension()
         
-        if self.index is None:
-            self.index = faiss.IndexFlatIP(dimension)  # Inner product for similarity
-        
         # Normalize embeddings for cosine similarity
         embeddings_array = np.array(embeddings).astype('float32')
         faiss.normalize_L2(embeddings_array)
         
+        if self.index is None:
+            self.index = self._create_index(dimension)
+        
         # Add to index
         start_id = len(self.documents)
         self.index.add(embeddings_array)
@@ -242,15 +262,21 @@ class RealVectorStore:
         
         logger.info(f"Added {len(split_docs)} document chunks to vector store")
     
-    def similarity_search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
-        """Search for similar documents"""
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 5,
+        query_embedding: Optional[List[float]] = None
+    ) -> List[Dict[str, Any]]:
+        """Search for similar documents, optionally with a precomputed query embedding"""
         if self.index is None or len(self.documents) == 0:
             logger.warning("Vector store is empty")
             return []
         
         try:
-            # Generate query embedding
-            query_embedding = self.embedding_model.embed_query(query)
+            # Generate query embedding unless the caller already has one
+            if query_embedding is None:
+                query_embedding = self.embedding_model.embed_query(query)
             query_vector = np.array([query_embedding]).astype('float32')
             faiss.normalize_L2(query_vector)
             
@@ -375,6 +401,9 @@ class RealVectorStore:
                     
                 logger.info(f"Loaded vector store with {len(self.documents)} documents")
             
+            if self.index is not None and not isinstance(self.index, faiss.IndexScalarQuantizer):
+                self._quantize_index()
+            
         except Exception as e:
             logger.error(f"Error loading vector store: {e}")
             # Reset to empty state
@@ -383,6 +412,15 @@ class RealVectorStore:
             self.document_metadata = []
             self.dimension = None
     
+    def _quantize_index(self):
+        """Re-encode a full-precision index saved by older versions into the int8 layout"""
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        index = self._create_index(self.index.d)
+        index.add(vectors)
+        self.index = index
+        self.save_store()
+        logger.info(f"Converted vector store index to int8 ({index.ntotal} vectors)")
+    
     def clear_store(self):
         """Clear all documents from the store"""
         self.index = None
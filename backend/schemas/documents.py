@@ -1,7 +1,7 @@
 """
 Pydantic schemas for Document-related API operations
 """
-from pydantic import BaseModel, validator, Field
+from pydantic import BaseModel, ConfigDict, validator, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 import uuid
@@ -36,8 +36,7 @@ class DocumentResponse(BaseModel):
     extracted_text_length: int
     metadata: Dict[str, Any]
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class DocumentProcessingStatus(BaseModel):
     """Schema for document processing status"""
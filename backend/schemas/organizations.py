@@ -1,7 +1,7 @@
 """
 Pydantic schemas for Organization-related API operations
 """
-from pydantic import BaseModel, EmailStr, validator, Field
+from pydantic import BaseModel, ConfigDict, EmailStr, validator, Field
 from typing import Optional, Dict, Any, List
 from datetime import datetime
 import uuid
@@ -46,8 +46,7 @@ class OrganizationResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class OrganizationUpdate(BaseModel):
     """Schema for updating organization settings"""
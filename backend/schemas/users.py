@@ -1,7 +1,7 @@
 """
 Pydantic schemas for User-related API operations
 """
-from pydantic import BaseModel, EmailStr, validator, Field
+from pydantic import BaseModel, ConfigDict, EmailStr, validator, Field
 from typing import Optional, List
 from datetime import datetime
 import uuid
@@ -36,8 +36,7 @@ class UserResponse(BaseModel):
     last_login: Optional[datetime]
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class UserUpdate(BaseModel):
     """Schema for updating user information"""
@@ -0,0 +1,116 @@
+"""
+Response cache for organization analytics
+Uses Redis when REDIS_URL is configured, otherwise an in-process TTL store
+"""
+import os
+import time
+import orjson
+import logging
+from cachetools import TTLCache
+from decimal import Decimal
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Admin-facing endpoints get a shorter TTL than user-facing dashboards
+ADMIN_CACHE_TTL = 60
+USER_CACHE_TTL = 300
+# Entries kept by the in-process store; the oldest are evicted beyond this
+LOCAL_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "1024"))
+
+def _json_default(obj: Any) -> Any:
+    """Encode types orjson does not handle natively, such as PostgreSQL numeric aggregates"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+class AnalyticsCache:
+    """Org-scoped analytics cache with mutation-based invalidation"""
+
+    def __init__(self, redis_url: Optional[str] = None):
+        self.redis = None
+        # Bounded by size and the longest TTL; entries also carry their own expiry
+        self.local_cache: TTLCache = TTLCache(
+            maxsize=LOCAL_CACHE_SIZE, ttl=max(ADMIN_CACHE_TTL, USER_CACHE_TTL)
+        )
+        self.hits = 0
+        self.misses = 0
+
+        if redis_url:
+            try:
+                import redis.asyncio as redis_asyncio
+                self.redis = redis_asyncio.from_url(redis_url, decode_responses=True)
+                logger.info("✅ Analytics cache using Redis")
+            except ImportError:
+                logger.warning("redis package not installed, using in-process analytics cache")
+
+    @staticmethod
+    def key(endpoint: str, org_id: Any) -> str:
+        """Build cache key; org_id is always the last segment so invalidation can match on it"""
+        return f"analytics:{endpoint}:{org_id}"
+
+    async def get(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Get cached response, or None on miss"""
+        value = None
+        try:
+            if self.redis is not None:
+                cached = await self.redis.get(cache_key)
+                if cached is not None:
+                    value = orjson.loads(cached)
+            else:
+                entry = self.local_cache.get(cache_key)
+                if entry and entry[0] > time.monotonic():
+                    value = entry[1]
+        except Exception as e:
+            logger.error(f"Analytics cache read failed: {e}")
+
+        if value is None:
+            self.misses += 1
+            logger.debug(f"Analytics cache miss: {cache_key}")
+        else:
+            self.hits += 1
+            logger.debug(f"Analytics cache hit: {cache_key}")
+
+        return value
+
+    async def set(self, cache_key: str, value: Dict[str, Any], ttl: int = USER_CACHE_TTL) -> None:
+        """Store response with TTL in seconds"""
+        # Round-trip through JSON so hits and misses return identical payloads
+        try:
+            payload = orjson.dumps(value, default=_json_default)
+            if self.redis is not None:
+                await self.redis.setex(cache_key, ttl, payload)
+            else:
+                self.local_cache[cache_key] = (time.monotonic() + ttl, orjson.loads(payload))
+        except Exception as e:
+            logger.error(f"Analytics cache write failed: {e}")
+
+    async def invalidate_org(self, org_id: Any) -> None:
+        """Drop every cached analytics response for an organization"""
+        pattern = f"analytics:*:{org_id}"
+        try:
+            if self.redis is not None:
+                keys = [key async for key in self.redis.scan_iter(match=pattern)]
+                if keys:
+                    await self.redis.delete(*keys)
+            else:
+                suffix = f":{org_id}"
+                for cache_key in [k for k in self.local_cache if k.endswith(suffix)]:
+                    self.local_cache.pop(cache_key, None)
+        except Exception as e:
+            logger.error(f"Analytics cache invalidation failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for tuning TTLs"""
+        total = self.hits + self.misses
+        return {
+            "backend": "redis" if self.redis is not None else "local",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total * 100, 1) if total else 0.0
+        }
+
+# Global instance
+analytics_cache = AnalyticsCache(REDIS_URL)
@@ -1,17 +1,20 @@
 """
 Authentication service for multi-tenant system
 """
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError
 from typing import Optional, Dict, Any
 import uuid
+import asyncio
 import hashlib
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 
 from database.models import User, Organization
 from schemas.auth import UserLogin, UserRegister, TokenData
+from auth.auth_utils import pwd_context
 import os
 
 # JWT Configuration
@@ -19,22 +22,23 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 class AuthService:
     """Service for user authentication within organizations"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
     
-    def hash_password(self, password: str) -> str:
-        """Hash a password"""
-        return pwd_context.hash(password)
+    async def hash_password(self, password: str) -> str:
+        """Hash a password (runs in a worker thread to keep the event loop free)"""
+        return await asyncio.to_thread(pwd_context.hash, password)
+    
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        """Verify a password against its hash in a worker thread"""
+        return await asyncio.to_thread(pwd_context.verify, plain_password, hashed_password)
     
-    def verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        """Verify a password against its hash"""
-        return pwd_context.verify(plain_password, hashed_password)
+    async def verify_and_update_password(self, plain_password: str, hashed_password: str):
+        """Verify a password; also returns a replacement hash if the stored one uses a deprecated scheme"""
+        return await asyncio.to_thread(pwd_context.verify_and_update, plain_password, hashed_password)
     
     def create_access_token(self, user: User) -> Dict[str, Any]:
         """Create JWT access token with org context"""
@@ -84,14 +88,16 @@ class AuthService:
         except JWTError:
             return None
     
-    def register_user(self, org_id: uuid.UUID, user_data: UserRegister) -> Dict[str, Any]:
+    async def register_user(self, org_id: uuid.UUID, user_data: UserRegister) -> Dict[str, Any]:
         """Register a new user within an organization"""
         try:
             # Check if organization exists and is active
-            org = self.db.query(Organization).filter(
-                Organization.org_id == org_id,
-                Organization.is_active == True
-            ).first()
+            org = await self.db.scalar(
+                select(Organization).where(
+                    Organization.org_id == org_id,
+                    Organization.is_active == True
+                ).limit(1)
+            )
             
             if not org:
                 return {
@@ -100,9 +106,11 @@ class AuthService:
                 }
             
             # Check if user already exists
-            existing_user = self.db.query(User).filter(
-                User.email == user_data.email
-            ).first()
+            existing_user = await self.db.scalar(
+                select(User).where(
+                    User.email == user_data.email
+                ).limit(1)
+            )
             
             if existing_user:
                 return {
@@ -111,7 +119,7 @@ class AuthService:
                 }
             
             # Create new user
-            hashed_password = self.hash_password(user_data.password)
+            hashed_password = await self.hash_password(user_data.password)
             
             user = User(
                 org_id=org_id,
@@ -123,8 +131,8 @@ class AuthService:
             )
             
             self.db.add(user)
-            self.db.commit()
-            self.db.refresh(user)
+            await self.db.commit()
+            await self.db.refresh(user)
             
             return {
                 "success": True,
@@ -133,26 +141,29 @@ class AuthService:
             }
             
         except IntegrityError as e:
-            self.db.rollback()
+            await self.db.rollback()
             return {
                 "success": False,
                 "message": f"Database error: {str(e)}"
             }
         except Exception as e:
-            self.db.rollback()
+            await self.db.rollback()
             return {
                 "success": False,
                 "message": f"Unexpected error: {str(e)}"
             }
     
-    def authenticate_user(self, login_data: UserLogin) -> Dict[str, Any]:
+    async def authenticate_user(self, login_data: UserLogin) -> Dict[str, Any]:
         """Authenticate user and return token"""
         try:
             # Find user by email
-            user = self.db.query(User).filter(
-                User.email == login_data.email,
-                User.is_active == True
-            ).first()
+            # Load the organization in the same round-trip; login always needs it
+            user = await self.db.scalar(
+                select(User).options(joinedload(User.organization)).where(
+                    User.email == login_data.email,
+                    User.is_active == True
+                ).limit(1)
+            )
             
             if not user:
                 return {
@@ -176,27 +187,27 @@ class AuthService:
                     }
             
             # Verify password
-            if not self.verify_password(login_data.password, user.password_hash):
+            verified, new_hash = await self.verify_and_update_password(login_data.password, user.password_hash)
+            if not verified:
                 return {
                     "success": False,
                     "message": "Invalid email or password"
                 }
             
             # Check if organization is active
-            org = self.db.query(Organization).filter(
-                Organization.org_id == user.org_id,
-                Organization.is_active == True
-            ).first()
+            org = user.organization
             
-            if not org:
+            if not org or not org.is_active:
                 return {
                     "success": False,
                     "message": "Organization is inactive"
                 }
             
-            # Update last login
+            # Update last login, upgrading legacy bcrypt hashes to Argon2id while we have the password
             user.last_login = datetime.utcnow()
-            self.db.commit()
+            if new_hash:
+                user.password_hash = new_hash
+            await self.db.commit()
             
             # Create token
             token_data = self.create_access_token(user)
@@ -220,29 +231,33 @@ class AuthService:
                 "message": f"Authentication error: {str(e)}"
             }
     
-    def get_user_by_token(self, token: str) -> Optional[User]:
-        """Get user from valid token"""
+    async def get_user_by_token(self, token: str, load_organization: bool = False) -> Optional[User]:
+        """Get user from valid token, optionally eager-loading user.organization"""
         token_data = self.verify_token(token)
         if not token_data:
             return None
         
-        user = self.db.query(User).filter(
-            User.user_id == token_data.user_id,
-            User.org_id == token_data.org_id,
-            User.is_active == True
-        ).first()
+        query = select(User)
+        if load_organization:
+            query = query.options(joinedload(User.organization))
+        
+        user = await self.db.scalar(
+            query.where(
+                User.user_id == token_data.user_id,
+                User.org_id == token_data.org_id,
+                User.is_active == True
+            ).limit(1)
+        )
         
         return user
     
-    def get_user_profile(self, token: str) -> Dict[str, Any]:
+    async def get_user_profile(self, token: str) -> Dict[str, Any]:
         """Get user profile from token"""
-        user = self.get_user_by_token(token)
+        user = await self.get_user_by_token(token, load_organization=True)
         if not user:
             return {"error": "Invalid or expired token"}
         
-        org = self.db.query(Organization).filter(
-            Organization.org_id == user.org_id
-        ).first()
+        org = user.organization
         
         return {
             "user_id": str(user.user_id),
@@ -256,23 +271,22 @@ class AuthService:
             "created_at": user.created_at.isoformat()
         }
     
-    def change_password(self, token: str, current_password: str, new_password: str) -> Dict[str, Any]:
+    async def change_password(self, token: str, current_password: str, new_password: str) -> Dict[str, Any]:
         """Change user password"""
-        user = self.get_user_by_token(token)
+        user = await self.get_user_by_token(token)
         if not user:
             return {"success": False, "message": "Invalid or expired token"}
         
         # Verify current password
-        if not self.verify_password(current_password, user.password_hash):
+        if not await self.verify_password(current_password, user.password_hash):
             return {"success": False, "message": "Current password is incorrect"}
         
         # Update password
         try:
-            user.password_hash = self.hash_password(new_password)
-            user.updated_at = datetime.utcnow()
-            self.db.commit()
+            user.password_hash = await self.hash_password(new_password)
+            await self.db.commit()
             
             return {"success": True, "message": "Password updated successfully"}
         except Exception as e:
-            self.db.rollback()
+            await self.db.rollback()
             return {"success": False, "message": f"Error updating password: {str(e)}"}
\ No newline at end of file
@@ -1,34 +1,38 @@
 """
 Organization service for multi-tenant operations
 """
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, func
 from sqlalchemy.exc import IntegrityError
 from typing import Optional, Dict, Any
+from datetime import datetime
 import uuid
+import asyncio
 import hashlib
-from passlib.context import CryptContext
 
-from database.models import Organization, User
+from database.models import Organization, User, Document, SearchLog
 from schemas.organizations import OrganizationCreate, OrganizationUpdate
 from schemas.users import UserCreate
+from auth.auth_utils import pwd_context
 
 class OrganizationService:
     """Service for organization management"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
-        self.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     
-    def create_organization(self, org_data: OrganizationCreate) -> Dict[str, Any]:
+    async def create_organization(self, org_data: OrganizationCreate) -> Dict[str, Any]:
         """
         Create a new organization with admin user
         Returns: {"success": bool, "org_id": UUID, "admin_user_id": UUID, "message": str}
         """
         try:
             # Check if organization name already exists
-            existing_org = self.db.query(Organization).filter(
-                Organization.org_name == org_data.org_name
-            ).first()
+            existing_org = await self.db.scalar(
+                select(Organization).where(
+                    Organization.org_name == org_data.org_name
+                ).limit(1)
+            )
             
             if existing_org:
                 return {
@@ -38,9 +42,11 @@ class OrganizationService:
             
             # Check if domain is already taken (if provided)
             if org_data.domain and org_data.domain.strip():
-                existing_domain = self.db.query(Organization).filter(
-                    Organization.domain == org_data.domain.strip()
-                ).first()
+                existing_domain = await self.db.scalar(
+                    select(Organization).where(
+                        Organization.domain == org_data.domain.strip()
+                    ).limit(1)
+                )
                 
                 if existing_domain:
                     return {
@@ -49,9 +55,11 @@ class OrganizationService:
                     }
             
             # Check if admin email already exists
-            existing_user = self.db.query(User).filter(
-                User.email == org_data.admin_email
-            ).first()
+            existing_user = await self.db.scalar(
+                select(User).where(
+                    User.email == org_data.admin_email
+                ).limit(1)
+            )
             
             if existing_user:
                 return {
@@ -77,10 +85,11 @@ class OrganizationService:
             )
             
             self.db.add(org)
-            self.db.flush()  # Get the org_id
+            await self.db.flush()  # Get the org_id
             
             # Create admin user with hashed password
-            password_hash = self.pwd_context.hash(org_data.admin_password)
+            # Password hashing is CPU-bound by design; hash off the event loop
+            password_hash = await asyncio.to_thread(pwd_context.hash, org_data.admin_password)
             admin_user = User(
                 org_id=org.org_id,
                 email=org_data.admin_email,
@@ -91,7 +100,7 @@ class OrganizationService:
             )
             
             self.db.add(admin_user)
-            self.db.commit()
+            await self.db.commit()
             
             return {
                 "success": True,
@@ -107,46 +116,50 @@ class OrganizationService:
             }
             
         except IntegrityError as e:
-            self.db.rollback()
+            await self.db.rollback()
             return {
                 "success": False,
                 "message": f"Database error: {str(e)}"
             }
         except Exception as e:
-            self.db.rollback()
+            await self.db.rollback()
             return {
                 "success": False,
                 "message": f"Unexpected error: {str(e)}"
             }
     
-    def get_organization(self, org_id: uuid.UUID) -> Optional[Organization]:
+    async def get_organization(self, org_id: uuid.UUID) -> Optional[Organization]:
         """Get organization by ID"""
-        return self.db.query(Organization).filter(
-            Organization.org_id == org_id,
-            Organization.is_active == True
-        ).first()
+        return await self.db.scalar(
+            select(Organization).where(
+                Organization.org_id == org_id,
+                Organization.is_active == True
+            ).limit(1)
+        )
     
-    def get_organization_by_domain(self, domain: str) -> Optional[Organization]:
+    async def get_organization_by_domain(self, domain: str) -> Optional[Organization]:
         """Get organization by domain"""
-        return self.db.query(Organization).filter(
-            Organization.domain == domain,
-            Organization.is_active == True
-        ).first()
+        return await self.db.scalar(
+            select(Organization).where(
+                Organization.domain == domain,
+                Organization.is_active == True
+            ).limit(1)
+        )
     
-    def update_organization(self, org_id: uuid.UUID, updates: OrganizationUpdate) -> Dict[str, Any]:
+    async def update_organization(self, org_id: uuid.UUID, updates: OrganizationUpdate) -> Dict[str, Any]:
         """Update organization settings"""
         try:
-            org = self.get_organization(org_id)
+            org = await self.get_organization(org_id)
             if not org:
                 return {"success": False, "message": "Organization not found"}
             
             # Update fields
-            update_data = updates.dict(exclude_unset=True)
+            update_data = updates.model_dump(exclude_unset=True)
             for field, value in update_data.items():
                 if hasattr(org, field):
                     setattr(org, field, value)
             
-            self.db.commit()
+            await self.db.commit()
             
             return {
                 "success": True,
@@ -154,38 +167,54 @@ class OrganizationService:
             }
             
         except Exception as e:
-            self.db.rollback()
+            await self.db.rollback()
             return {
                 "success": False,
                 "message": f"Error updating organization: {str(e)}"
             }
     
-    def get_organization_stats(self, org_id: uuid.UUID) -> Dict[str, Any]:
+    async def get_organization_stats(self, org_id: uuid.UUID) -> Dict[str, Any]:
         """Get organization statistics"""
-        org = self.get_organization(org_id)
-        if not org:
-            return {"error": "Organization not found"}
+        month_start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
         
-        # Count related entities
-        total_users = self.db.query(User).filter(
+        # Every counter is a scalar subquery, so the org lookup and all counts are one round-trip
+        total_users = select(func.count(User.user_id)).where(
             User.org_id == org_id,
             User.is_active == True
-        ).count()
+        ).scalar_subquery()
+        total_documents = select(func.count(Document.document_id)).where(
+            Document.org_id == org_id
+        ).scalar_subquery()
+        total_size = select(func.coalesce(func.sum(Document.file_size), 0)).where(
+            Document.org_id == org_id
+        ).scalar_subquery()
+        searches_this_month = select(func.count(SearchLog.log_id)).where(
+            SearchLog.org_id == org_id,
+            SearchLog.timestamp >= month_start
+        ).scalar_subquery()
         
-        total_documents = len(org.documents)
-        
-        # Calculate storage used (would need to implement)
-        storage_used_mb = sum(doc.file_size for doc in org.documents) / (1024 * 1024)
+        stats = (await self.db.execute(
+            select(
+                Organization.plan_type,
+                total_users.label('total_users'),
+                total_documents.label('total_documents'),
+                total_size.label('total_size'),
+                searches_this_month.label('searches_this_month')
+            ).where(
+                Organization.org_id == org_id,
+                Organization.is_active == True
+            )
+        )).one_or_none()
         
-        # Get plan limits
-        plan_limits = self._get_plan_limits(org.plan_type)
+        if not stats:
+            return {"error": "Organization not found"}
         
         return {
-            "total_documents": total_documents,
-            "total_users": total_users,
-            "total_searches_this_month": 0,  # TODO: Implement
-            "storage_used_mb": round(storage_used_mb, 2),
-            "plan_limits": plan_limits
+            "total_documents": stats.total_documents,
+            "total_users": stats.total_users,
+            "total_searches_this_month": stats.searches_this_month,
+            "storage_used_mb": round(stats.total_size / (1024 * 1024), 2),
+            "plan_limits": self._get_plan_limits(stats.plan_type)
         }
     
     def _get_plan_limits(self, plan_type: str) -> Dict[str, Any]:
@@ -222,21 +251,21 @@ class OrganizationService:
         
         return f"org_{short_hash}_docs"
     
-    def deactivate_organization(self, org_id: uuid.UUID) -> Dict[str, Any]:
+    async def deactivate_organization(self, org_id: uuid.UUID) -> Dict[str, Any]:
         """Deactivate an organization (soft delete)"""
         try:
-            org = self.get_organization(org_id)
+            org = await self.get_organization(org_id)
             if not org:
                 return {"success": False, "message": "Organization not found"}
             
             org.is_active = False
             
             # Deactivate all users
-            self.db.query(User).filter(User.org_id == org_id).update(
-                {"is_active": False}
+            await self.db.execute(
+                update(User).where(User.org_id == org_id).values(is_active=False)
             )
             
-            self.db.commit()
+            await self.db.commit()
             
             return {
                 "success": True,
@@ -244,7 +273,7 @@ class OrganizationService:
             }
             
         except Exception as e:
-            self.db.rollback()
+            await self.db.rollback()
             return {
                 "success": False,
                 "message": f"Error deactivating organization: {str(e)}"
@@ -1,5 +1,7 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import requests
+import httpx
+import asyncio
 import os
 import logging
 import re
@@ -16,54 +18,87 @@ class RealWebSearchTool:
         self.api_key = os.getenv("GOOGLE_CSE_API_KEY")
         self.cse_id = os.getenv("GOOGLE_CSE_ID")
         self.base_url = "https://www.googleapis.com/customsearch/v1"
+        # Created on first async search so it binds to the running event loop
+        self._async_client: Optional[httpx.AsyncClient] = None
     
     def search(self, query: str, num_results: int = 5) -> Dict[str, Any]:
         """Perform web search using Google Custom Search API"""
         
         if not self.api_key or not self.cse_id:
-            return {
-                "status": "error",
-                "message": "Google Custom Search API credentials not configured. Using fallback search.",
-                "results": self._fallback_search(query, num_results)
-            }
+            return self._missing_credentials(query, num_results)
         
         try:
-            params = {
-                "key": self.api_key,
-                "cx": self.cse_id,
-                "q": query,
-                "num": min(num_results, 10)  # API limit is 10
-            }
-            
-            response = requests.get(self.base_url, params=params, timeout=10)
+            response = requests.get(self.base_url, params=self._params(query, num_results), timeout=10)
             response.raise_for_status()
             
-            data = response.json()
+            return self._format_results(query, response.json())
             
-            results = []
-            for item in data.get("items", []):
-                results.append({
-                    "title": item.get("title", ""),
-                    "link": item.get("link", ""),
-                    "snippet": item.get("snippet", ""),
-                    "displayLink": item.get("displayLink", "")
-                })
+        except Exception as e:
+            logger.error(f"Error in web search: {e}")
+            return self._search_failed(query, num_results, e)
+    
+    async def asearch(self, query: str, num_results: int = 5) -> Dict[str, Any]:
+        """Async variant of search; reuses one pooled connection instead of a worker thread"""
+        
+        if not self.api_key or not self.cse_id:
+            return self._missing_credentials(query, num_results)
+        
+        try:
+            if self._async_client is None:
+                self._async_client = httpx.AsyncClient(timeout=10.0)
             
-            return {
-                "status": "success",
-                "query": query,
-                "total_results": data.get("searchInformation", {}).get("totalResults", "0"),
-                "search_time": data.get("searchInformation", {}).get("searchTime", "0"),
-                "results": results
-            }
+            response = await self._async_client.get(self.base_url, params=self._params(query, num_results))
+            response.raise_for_status()
+            
+            return self._format_results(query, response.json())
             
         except Exception as e:
             logger.error(f"Error in web search: {e}")
-            return {
-                "status": "error",
-                "message": f"Search failed: {str(e)}",
-                "results": self._fallback_search(query, num_results)
-            }
+            return self._search_failed(query, num_results, e)
+    
+    def _params(self, query: str, num_results: int) -> Dict[str, Any]:
+        """Query parameters for the Custom Search API"""
+        return {
+            "key": self.api_key,
+            "cx": self.cse_id,
+            "q": query,
+            "num": min(num_results, 10)  # API limit is 10
+        }
+    
+    def _missing_credentials(self, query: str, num_results: int) -> Dict[str, Any]:
+        """Response when the API isn't configured"""
+        return {
+            "status": "error",
+            "message": "Google Custom Search API credentials not configured. Using fallback search.",
+            "results": self._fallback_search(query, num_results)
+        }
+    
+    def _search_failed(self, query: str, num_results: int, error: Exception) -> Dict[str, Any]:
+        """Response when the API call fails"""
+        return {
+            "status": "error",
+            "message": f"Search failed: {str(error)}",
+            "results": self._fallback_search(query, num_results)
+        }
+    
+    def _format_results(self, query: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Shape a Custom Search API payload into the tool's result format"""
+        results = []
+        for item in data.get("items", []):
+            results.append({
+                "title": item.get("title", ""),
+                "link": item.get("link", ""),
+                "snippet": item.get("snippet", ""),
+                "displayLink": item.get("displayLink", "")
+            })
+        
+        return {
+            "status": "success",
+            "query": query,
+            "total_results": data.get("searchInformation", {}).get("totalResults", "0"),
+            "search_time": data.get("searchInformation", {}).get("searchTime", "0"),
+            "results": results
+        }
     
     def _fallback_search(self, query: str, num_results: int) -> list:
         """Fallback search results when API is not available"""
@@ -382,19 +417,43 @@ class RealToolRegistry:
             method_func = getattr(tool, method)
             result = method_func(**kwargs)
             
-            return {
-                "status": "success",
-                "tool": tool_name,
-                "method": method,
-                "result": result,
-                "timestamp": datetime.now().isoformat()
-            }
+            return self._success(tool_name, method, result)
             
         except Exception as e:
             logger.error(f"Error executing {tool_name}.{method}: {e}")
-            return {
-                "status": "error",
-                "message": f"Tool execution failed: {str(e)}",
-                "tool": tool_name,
-                "method": method
-            }
\ No newline at end of file
+            return self._failure(tool_name, method, e)
+    
+    async def aexecute_tool(self, tool_name: str, method: str, **kwargs) -> Dict[str, Any]:
+        """Async execute_tool; awaits the tool's native async method (a<method>) when it has one"""
+        async_method = getattr(self.get_tool(tool_name), f"a{method}", None)
+        if async_method is None:
+            # No async variant; keep the blocking call off the event loop
+            return await asyncio.to_thread(self.execute_tool, tool_name, method, **kwargs)
+        
+        try:
+            result = await async_method(**kwargs)
+            
+            return self._success(tool_name, method, result)
+            
+        except Exception as e:
+            logger.error(f"Error executing {tool_name}.{method}: {e}")
+            return self._failure(tool_name, method, e)
+    
+    def _success(self, tool_name: str, method: str, result: Any) -> Dict[str, Any]:
+        """Wrap a tool method's return value"""
+        return {
+            "status": "success",
+            "tool": tool_name,
+            "method": method,
+            "result": result,
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    def _failure(self, tool_name: str, method: str, error: Exception) -> Dict[str, Any]:
+        """Wrap a tool method's exception"""
+        return {
+            "status": "error",
+            "message": f"Tool execution failed: {str(error)}",
+            "tool": tool_name,
+            "method": method
+        }
\ No newline at end of file